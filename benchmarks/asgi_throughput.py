@@ -0,0 +1,101 @@
+"""
+Measures requests/second of the sync WSGI app (one gunicorn sync worker)
+against the ASGI app (one uvicorn worker) under the same concurrency.
+
+    python benchmarks/asgi_throughput.py [concurrency] [seconds] [path]
+
+Both servers run against the same seeded database (DATABASE_URL, or a
+temporary SQLite file). Use Postgres for numbers that mean anything: SQLite
+round trips are too cheap for the async engine to pay off.
+"""
+import datetime
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+SERVERS = {
+    "wsgi (gunicorn, 1 sync worker)": ["gunicorn", "-w", "1", "-b", "127.0.0.1:{port}", "wsgi"],
+    "asgi (uvicorn, 1 worker)": ["uvicorn", "asgi:application", "--port", "{port}", "--log-level", "warning"],
+}
+
+
+def seed(env):
+    sys.path.insert(0, SRC)
+    os.environ.update(env)
+    from app import app
+    from models import db, User, People, Planets
+
+    with app.app_context():
+        db.create_all()
+        if db.session.execute(db.select(People.id).limit(1)).first() is None:
+            db.session.execute(db.insert(People), [{"name_of_people": f"Character {i}"} for i in range(2000)])
+            db.session.execute(db.insert(Planets), [{"name_of_planets": f"Planet {i}"} for i in range(2000)])
+            db.session.execute(db.insert(User), [{
+                "email": f"user{i}@example.com", "password": "secret", "is_active": True,
+                "user_name": f"user{i}", "first_name": "First", "last_name": "Last",
+                "subscription_date": datetime.datetime(2025, 1, 1)} for i in range(200)])
+            db.session.commit()
+
+
+def wait_until_up(port):
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/people?limit=1")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def hammer(port, path, concurrency, seconds):
+    done = []
+    deadline = time.monotonic() + seconds
+
+    def client():
+        count = 0
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.monotonic() < deadline:
+            connection.request("GET", path)
+            connection.getresponse().read()
+            count += 1
+        done.append(count)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / seconds
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    path = sys.argv[3] if len(sys.argv) > 3 else "/people?limit=50"
+
+    env = {"DATABASE_URL": os.getenv(
+        "DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))}
+    seed(env)
+
+    print(f"GET {path}, {concurrency} concurrent clients, {seconds:.0f}s each")
+    for port, (name, command) in enumerate(SERVERS.items(), start=8811):
+        command = [part.format(port=port) for part in command]
+        server = subprocess.Popen(command, cwd=SRC, env={**os.environ, **env})
+        try:
+            wait_until_up(port)
+            print(f"{name:<32}{hammer(port, path, concurrency, seconds):10.1f} req/s")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Compares the stdlib encoder with the FastJSONProvider encoder on payloads
+shaped like /people and /favorite/<user_id>.
+
+    python benchmarks/json_encoding.py
+"""
+import datetime
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from flask import Flask  # noqa: E402
+import json_provider  # noqa: E402
+from json_provider import FastJSONProvider  # noqa: E402
+
+PAYLOADS = {
+    "people page (1000)": {
+        "results": [{"id": i, "name_of_people": f"Character {i}"} for i in range(1000)],
+        "next_cursor": 1000,
+    },
+    "favorites (500 + 500)": {
+        "user_id": 7,
+        "favorite_planets": [{"id": i, "name_of_planets": f"Planet {i}"} for i in range(500)],
+        "favorite_people": [{"id": i, "name_of_people": f"Character {i}"} for i in range(500)],
+    },
+    "users (1000, datetimes)": [{
+        "id": i,
+        "email": f"user{i}@example.com",
+        "user_name": f"user{i}",
+        "is_active": True,
+        "subscription_date": datetime.datetime(2025, 1, 1, 12, 0, i % 60),
+    } for i in range(1000)],
+}
+
+
+def main():
+    provider = FastJSONProvider(Flask(__name__))
+    if json_provider.orjson is None:
+        print("orjson is not installed, both columns use the stdlib")
+
+    print(f"{'payload':<26}{'stdlib':>12}{'provider':>12}")
+    for name, payload in PAYLOADS.items():
+        stdlib = timeit.timeit(
+            lambda: json.dumps(payload, default=provider.default, sort_keys=True), number=200)
+        fast = timeit.timeit(lambda: provider.dumps(payload), number=200)
+        print(f"{name:<26}{stdlib / 200 * 1e3:>9.3f} ms{fast / 200 * 1e3:>9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compares the ORM read path (scalars().all() + serialize()) with the
+column-projected one used by the list endpoints.
+
+    python benchmarks/read_path.py [rows]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_FILE
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from app import app  # noqa: E402
+from models import db, select_serialized, User  # noqa: E402
+
+
+def orm_path():
+    users = db.session.execute(db.select(User)).scalars().all()
+    return [user.serialize() for user in users]
+
+
+def projected_path():
+    rows = db.session.execute(select_serialized(User)).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def measure(fn, rounds=5):
+    best = None
+    for _ in range(rounds):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(User), [{
+            "email": f"user{i}@example.com",
+            "password": "secret",
+            "is_active": True,
+            "user_name": f"user{i}",
+            "first_name": "First",
+            "last_name": "Last",
+            "subscription_date": datetime.datetime(2025, 1, 1),
+        } for i in range(rows)])
+        db.session.commit()
+
+        print(f"{rows} users")
+        for name, fn in (("orm + serialize", orm_path), ("projected rows", projected_path)):
+            elapsed, peak = measure(fn)
+            print(f"{name:<16} {elapsed * 1e6 / rows:8.2f} us/row "
+                  f"{peak / rows:8.0f} B/row peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Gunicorn settings, used by the Procfile and render.yaml start commands.
+# Every value can be overridden with the usual GUNICORN_CMD_ARGS / env vars.
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Workers share their Prometheus samples through this directory. It has to be
+# set, and emptied of samples from a previous run, before the app (and with
+# it prometheus_client) is preloaded.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                      os.path.join(tempfile.gettempdir(), "flask-rest-metrics"))
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+# Capped by default: each worker holds its own database pool. The count is
+# exported so the preloaded app can split DB_MAX_CONNECTIONS between them.
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# Threaded workers: concurrent identical GETs in one worker can then share a
+# single execution (@coalesced), which never happens with one sync thread.
+# Keep threads at or below the per-worker pool size (see DB_MAX_CONNECTIONS).
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers:
+    # give every worker a fresh pool without closing the parent's sockets.
+    from app import app
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -77,13 +77,31 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # the search tables and indexes are created by hand in a migration and
+    # have no model, so autogenerate must not offer to drop them
+    def include_name(name, type_, parent_names):
+        if type_ == 'table':
+            return '_fts' not in name
+        if type_ == 'index':
+            return not name.endswith(('_nocase', '_prefix', '_trgm'))
+        return True
+
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
+        # batch migrations on SQLite copy and drop tables, which would trip
+        # the foreign keys the app enables on every connection
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            # end the transaction the PRAGMA autobegan, or alembic would run
+            # inside it and nothing would ever be committed
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_name=include_name,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,50 @@
+"""cascade favorites on delete
+
+Revision ID: 0f5b7a9e2c64
+Revises: e6a3c95d1f48
+Create Date: 2026-10-18 15:47:26.110942
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0f5b7a9e2c64'
+down_revision = 'e6a3c95d1f48'
+branch_labels = None
+depends_on = None
+
+FAVORITES = (('user_planet_favorites', 'planet_id', 'planets'),
+             ('user_people_favorites', 'character_id', 'people'))
+
+
+def favorites_table(table, column, target, ondelete):
+    return sa.Table(
+        table, sa.MetaData(),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id', ondelete=ondelete), primary_key=True),
+        sa.Column(column, sa.Integer(), sa.ForeignKey(f'{target}.id', ondelete=ondelete), primary_key=True),
+    )
+
+
+def replace_foreign_keys(ondelete):
+    for table, column, target in FAVORITES:
+        if op.get_bind().dialect.name == 'sqlite':
+            # SQLite cannot alter a constraint and the originals are unnamed:
+            # rebuild the table from the definition we want
+            with op.batch_alter_table(table, recreate='always',
+                                      copy_from=favorites_table(table, column, target, ondelete)):
+                pass
+        else:
+            for fk_column, referent in (('user_id', 'user'), (column, target)):
+                name = f'{table}_{fk_column}_fkey'
+                op.drop_constraint(name, table, type_='foreignkey')
+                op.create_foreign_key(name, table, referent, [fk_column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys(None)
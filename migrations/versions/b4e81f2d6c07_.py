@@ -0,0 +1,56 @@
+"""name search indexes
+
+Revision ID: b4e81f2d6c07
+Revises: 7d2e4b9c5a13
+Create Date: 2026-10-18 14:21:37.502118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e81f2d6c07'
+down_revision = '7d2e4b9c5a13'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = (('people', 'name_of_people'), ('planets', 'name_of_planets'))
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table, column in SEARCH_COLUMNS:
+        if dialect == 'sqlite':
+            fts = f'{table}_fts'
+            op.execute(f'CREATE INDEX ix_{table}_{column}_nocase ON {table} ({column} COLLATE NOCASE)')
+            op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                       f"{column}, content='{table}', content_rowid='id', tokenize='trigram')")
+            op.execute(f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN '
+                       f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            op.execute(f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+            op.execute(f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                       f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        elif dialect == 'postgresql':
+            op.execute(f'CREATE INDEX ix_{table}_{column}_prefix ON {table} (lower({column}) text_pattern_ops)')
+            op.execute(f'CREATE INDEX ix_{table}_{column}_trgm ON {table} USING gin (lower({column}) gin_trgm_ops)')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCH_COLUMNS:
+        if dialect == 'sqlite':
+            fts = f'{table}_fts'
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {fts}')
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_nocase')
+        elif dialect == 'postgresql':
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_trgm')
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_prefix')
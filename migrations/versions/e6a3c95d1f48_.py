@@ -0,0 +1,35 @@
+"""favorite counters
+
+Revision ID: e6a3c95d1f48
+Revises: b4e81f2d6c07
+Create Date: 2026-10-18 15:02:11.847320
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a3c95d1f48'
+down_revision = 'b4e81f2d6c07'
+branch_labels = None
+depends_on = None
+
+COUNTERS = (('planets', 'user_planet_favorites', 'planet_id'),
+            ('people', 'user_people_favorites', 'character_id'))
+
+
+def upgrade():
+    # Plain ADD COLUMN rather than batch mode: recreating people/planets on
+    # SQLite would drop the search triggers from b4e81f2d6c07
+    for table, favorites, column in COUNTERS:
+        op.add_column(table, sa.Column('favorite_count', sa.Integer(), nullable=False, server_default='0'))
+        op.execute(f'UPDATE {table} SET favorite_count = '
+                   f'(SELECT count(*) FROM {favorites} WHERE {favorites}.{column} = {table}.id)')
+        op.create_index(f'ix_{table}_favorite_count', table, ['favorite_count', 'id'], unique=False)
+
+
+def downgrade():
+    for table, _, _ in COUNTERS:
+        op.drop_index(f'ix_{table}_favorite_count', table_name=table)
+        op.drop_column(table, 'favorite_count')
@@ -2,17 +2,40 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
+import hashlib
+import hmac
+import click
+from flask import Flask, Response, request, jsonify, url_for, stream_with_context
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import APIException, generate_sitemap, get_page_args, get_id_list
 from admin import setup_admin
-from models import db, User, People, Planets
+from replica import setup_replica
+from metrics import setup_metrics
+from sql_inspector import setup_sql_inspector
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from models import db, dialect_insert, select_serialized, User, People, Planets, user_planet_favorites, user_people_favorites
+from versions import bump_versions, conditional, flushed_changes
+from cache import ObjectCache
+from json_provider import FastJSONProvider
+from compression import Compress
+from pool import TimedQueuePool
+from singleflight import SingleFlight, coalesced
+from response_cache import ResponseCache
+from search import get_search_args, search_statement, search_payload
+from importer import import_swapi
+from export import (EXPORT_TABLES, EXPORT_FORMATS, export_command, export_statement,
+                    export_header, encode_export_batch, get_id_range)
 # from models import Person
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+app.json = FastJSONProvider(app)
+app.json.sort_keys = os.getenv("JSON_SORT_KEYS", "1") == "1"
+if os.getenv("JSON_PRETTY") is not None:
+    app.json.compact = os.getenv("JSON_PRETTY") != "1"
 
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
@@ -20,12 +43,72 @@ if db_url is not None:
         "postgres://", "postgresql://")
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+replica_url = os.getenv("DATABASE_REPLICA_URL")
+if replica_url is not None:
+    app.config['SQLALCHEMY_BINDS'] = {
+        "replica": replica_url.replace("postgres://", "postgresql://")}
+app.config['REPLICA_STICKY_SECONDS'] = int(os.getenv("REPLICA_STICKY_SECONDS", 5))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if ":memory:" not in app.config['SQLALCHEMY_DATABASE_URI']:
+    # Every gunicorn worker (WEB_CONCURRENCY, exported by gunicorn.conf.py)
+    # has its own pool: together they must stay within DB_MAX_CONNECTIONS,
+    # which leaves room under Postgres' default max_connections of 100 for
+    # migrations and admin sessions.
+    pool_budget = max(int(os.getenv("DB_MAX_CONNECTIONS", 80)) // int(os.getenv("WEB_CONCURRENCY", 1)), 1)
+    pool_size = min(int(os.getenv("DB_POOL_SIZE", 5)), pool_budget)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "poolclass": TimedQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": min(int(os.getenv("DB_MAX_OVERFLOW", 10)), pool_budget - pool_size),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+    statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and app.config['SQLALCHEMY_DATABASE_URI'].startswith("postgresql"):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']["connect_args"] = {
+            "options": f"-c statement_timeout={int(statement_timeout)}"}
+app.config['DEFAULT_PAGE_LIMIT'] = int(os.getenv("DEFAULT_PAGE_LIMIT", 100))
+app.config['MAX_PAGE_LIMIT'] = int(os.getenv("MAX_PAGE_LIMIT", 1000))
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv("STREAM_BATCH_SIZE", 500))
+app.config['MAX_IDS_PER_REQUEST'] = int(os.getenv("MAX_IDS_PER_REQUEST", 100))
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv("COMPRESS_MIN_SIZE", 500))
+app.config['COMPRESS_LEVEL'] = int(os.getenv("COMPRESS_LEVEL", 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv("COMPRESS_BROTLI_QUALITY", 5))
+app.config['SQL_INSTRUMENTATION'] = os.getenv("SQL_INSTRUMENTATION") == "1"
+app.config['SLOW_QUERY_MS'] = float(os.getenv("SLOW_QUERY_MS", 100))
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv("N_PLUS_ONE_THRESHOLD", 3))
+app.config['BULK_MAX_ITEMS'] = int(os.getenv("BULK_MAX_ITEMS", 10000))
+# Keeps IN (...) lists under the bound parameter limit of every backend
+app.config['BULK_CHUNK_SIZE'] = int(os.getenv("BULK_CHUNK_SIZE", 500))
+app.config['POPULAR_DEFAULT_LIMIT'] = int(os.getenv("POPULAR_DEFAULT_LIMIT", 10))
+app.config['IMPORT_CHUNK_SIZE'] = int(os.getenv("IMPORT_CHUNK_SIZE", 5000))
+app.config['SINGLE_FLIGHT'] = os.getenv("SINGLE_FLIGHT", "1") == "1"
+# memory://, sqlite:////path/to/file.db or redis://host:port/db; unset disables it
+app.config['RESPONSE_CACHE_URL'] = os.getenv("RESPONSE_CACHE_URL")
+app.config['RESPONSE_CACHE_TTL'] = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+app.config['RESPONSE_CACHE_MAX_AGE'] = int(os.getenv("RESPONSE_CACHE_MAX_AGE", 0))
+# GET /export/<table> is disabled unless a token is configured
+app.config['EXPORT_TOKEN'] = os.getenv("EXPORT_TOKEN")
+
+object_cache = ObjectCache(
+    maxsize=int(os.getenv("OBJECT_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("OBJECT_CACHE_TTL", 30)))
+
+# Identical GETs running at the same time in this worker share one execution
+single_flight = SingleFlight(timeout=float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 30)))
 
 MIGRATE = Migrate(app, db)
+app.cli.add_command(import_swapi)
+app.cli.add_command(export_command)
 db.init_app(app)
 CORS(app)
+compress = Compress(app)
+response_cache = ResponseCache(app)
 setup_admin(app)
+setup_replica(app)
+setup_metrics(app, db)
+setup_sql_inspector(app)
 
 # Handle/serialize errors like a JSON object
 
@@ -40,22 +123,238 @@ def sitemap():
     return generate_sitemap(app)
 
 
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({
+        "objects": object_cache.stats(),
+        "compressed": compress.cache.stats(),
+        "single_flight": single_flight.stats(),
+        "responses": response_cache.stats()
+    }), 200
+
+
+@app.route('/pool/stats', methods=['GET'])
+def get_pool_stats():
+    stats = {}
+    for bind, engine in db.engines.items():
+        pool = engine.pool
+        stats[bind or "default"] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            **pool.stats.to_dict()
+        } if isinstance(pool, TimedQueuePool) else {"status": pool.status()}
+    return jsonify(stats), 200
+
+
+def cached_entity(model, id):
+    # Keep the serialized dict and its ETag so a hot entity costs no SQL. A
+    # shared cache miss skips it: this worker's copy may predate the tag
+    # generations the response is about to be stored under.
+    key = (model.__tablename__, id)
+    entry = None if response_cache.filling() else object_cache.get(key)
+    if entry is None:
+        row = db.session.execute(
+            select_serialized(model).where(model.id == id)).mappings().first()
+        if row is None:
+            return None
+        entry = entity_entry(dict(row))
+        object_cache.set(key, entry)
+    return entry
+
+
+def entity_entry(payload):
+    tag = hashlib.sha1(app.json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return (payload, tag)
+
+
+def entity_response(entry):
+    payload, tag = entry
+    response = jsonify(payload)
+    response.set_etag(tag)
+    return response.make_conditional(request)
+
+
+# Shared response cache tags of each table: its list tag and its entity tag
+CACHE_TAGS = {
+    "user": ("users", "user"),
+    "people": ("people", "character"),
+    "planets": ("planets", "planet"),
+}
+
+
+def cache_tags(model, ids=()):
+    list_tag, entity_tag = CACHE_TAGS[model.__tablename__]
+    return [list_tag] + [f"{entity_tag}:{id}" for id in ids]
+
+
+@event.listens_for(db.session, "after_flush")
+def collect_flushed_entities(session, flush_context):
+    # ORM writes outside the routes (Flask-Admin, shell, CLI) reach the
+    # caches too; invalidated once the transaction has committed
+    pending = session.info.setdefault("flushed_entities", set())
+    for obj, favorites in flushed_changes(session):
+        if obj.__tablename__ in CACHE_TAGS:
+            pending.add((type(obj), obj.id, favorites))
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_flushed_entities(session):
+    pending = session.info.pop("flushed_entities", None)
+    if not pending:
+        return
+    tags = []
+    for model, id, favorites in pending:
+        object_cache.invalidate((model.__tablename__, id))
+        tags += cache_tags(model, [id])
+        if favorites:
+            tags.append(f"user:{id}:favorites")
+    response_cache.invalidate(*tags)
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_flushed_entities(session):
+    session.info.pop("flushed_entities", None)
+
+
+def counts_name(model):
+    # favorite_count has its own version and tag: a favorite write must not
+    # invalidate what only shows names and rows, e.g. /favorite/<user_id>
+    return f"{model.__tablename__}:counts"
+
+
+def count_tags(model, ids=()):
+    entity_tag = CACHE_TAGS[model.__tablename__][1]
+    return [counts_name(model)] + [f"{entity_tag}:{id}" for id in ids]
+
+
+def keyset_page(model):
+    # Seek past the cursor on the primary key instead of using OFFSET, so
+    # every page costs the same no matter how deep the client goes.
+    limit, after = get_page_args(
+        request.args, app.config['DEFAULT_PAGE_LIMIT'], app.config['MAX_PAGE_LIMIT'])
+
+    rows = db.session.execute(keyset_statement(model, limit, after)).mappings().all()
+    return keyset_payload(rows, limit)
+
+
+def keyset_statement(model, limit, after):
+    # one extra row tells us whether there is a next page
+    stmt = select_serialized(model).order_by(model.id).limit(limit + 1)
+    if after is not None:
+        stmt = stmt.where(model.id > after)
+    return stmt
+
+
+def keyset_payload(rows, limit):
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return {
+        "results": [dict(row) for row in rows[:limit]],
+        "next_cursor": next_cursor
+    }
+
+
+def search_page(model):
+    q, limit, after = get_search_args(
+        request.args, app.config['DEFAULT_PAGE_LIMIT'], app.config['MAX_PAGE_LIMIT'])
+
+    stmt = search_statement(model, q, limit, after, db.engine.dialect.name)
+    return search_payload(db.session.execute(stmt).mappings(), limit)
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def existing_values(column, values):
+    found = set()
+    for batch in chunks(list(values), app.config['BULK_CHUNK_SIZE']):
+        found.update(db.session.execute(
+            db.select(column).where(column.in_(batch))).scalars())
+    return found
+
+
+def rows_by_ids(model, ids):
+    rows = db.session.execute(
+        select_serialized(model).where(model.id.in_(ids))).mappings()
+    return ids_payload(rows, ids)
+
+
+def ids_payload(rows, ids):
+    by_id = {row["id"]: dict(row) for row in rows}
+    return {
+        "results": [by_id[id] for id in ids if id in by_id],
+        "missing": [id for id in ids if id not in by_id]
+    }
+
+
+def list_response(model):
+    ids = get_id_list(request.args, app.config['MAX_IDS_PER_REQUEST'])
+    if ids is not None:
+        return jsonify(rows_by_ids(model, ids)), 200
+    if "q" in request.args:
+        return jsonify(search_page(model)), 200
+    if wants_stream():
+        return stream_table(model)
+    return jsonify(keyset_page(model)), 200
+
+
+def wants_stream():
+    return (request.args.get("stream") == "1"
+            or request.accept_mimetypes.best == "application/x-ndjson")
+
+
+def stream_table(model):
+    # Read the whole table in batches and write it out as we go, so memory
+    # stays flat no matter how many rows there are.
+    ndjson = request.accept_mimetypes.best == "application/x-ndjson"
+    stmt = stream_statement(model)
+
+    def generate():
+        first = True
+        if not ndjson:
+            yield "["
+        for batch in db.session.execute(stmt).mappings().partitions():
+            yield encode_stream_batch(batch, ndjson, first)
+            first = False
+        if not ndjson:
+            yield "]"
+
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def stream_statement(model):
+    return select_serialized(model).order_by(model.id).execution_options(
+        yield_per=app.config['STREAM_BATCH_SIZE'])
+
+
+def encode_stream_batch(batch, ndjson, first):
+    rows = [app.json.dumps(dict(row)) for row in batch]
+    if ndjson:
+        return "\n".join(rows) + "\n"
+    return ("" if first else ",") + ",".join(rows)
+
+
 @app.route('/users', methods=['GET'])
+@conditional("user")
+@response_cache.cached("users", private=True)
+@coalesced(single_flight)
 def get_users():
-    users = db.session.execute(db.select(User)).scalars().all()
-    return jsonify([user.serialize() for user in users]), 200
+    return list_response(User)
 
 
 @app.route('/user/<int:id>', methods=['GET'])
+@response_cache.cached("user:{id}", private=True)
+@coalesced(single_flight)
 def get_user_by_id(id):
-    user = db.session.execute(
-        db.select(User).filter_by(id=id)
-    ).scalar_one_or_none()
+    user = cached_entity(User, id)
 
     if user is None:
         return jsonify({"message": "User not found"}), 404
 
-    return jsonify(user.serialize()), 200
+    return entity_response(user)
 
 
 @app.route('/user', methods=["POST"])
@@ -110,61 +409,146 @@ def delete_user_by_id(id):
         return jsonify({"message": "User not found"}), 404
 
     try:
+        # Take the user's favorites out of the counters before the
+        # association rows go away with the user
+        uncounted = uncount_favorites([id])
         db.session.delete(user)
+        bump_versions(*[counts_name(model) for model, ids in uncounted.items() if ids])
         db.session.commit()
     except Exception as error:
         print(error)
         db.session.rollback()
         return jsonify({"message": "Internal server error"}), 500
+    # the user's own entries go through the flush hook; the counters did not
+    tags = []
+    for model, ids in uncounted.items():
+        for target_id in ids:
+            object_cache.invalidate((model.__tablename__, target_id))
+        if ids:
+            tags += count_tags(model, ids)
+    response_cache.invalidate(*tags)
     return jsonify({
         "message": "User delete succefully"
     }), 201
 
 
-def get_user_by_id(user_id):
-    return User.query.get(user_id)
-
+def favorite_target_missing(user_id, model, target_id, not_found):
+    # Only reached when a favorite write touched no rows, to tell the caller why
+    user_exists, target_exists = db.session.execute(
+        favorite_exists_statement(user_id, model, target_id)).one()
 
-@app.route('/favorite/planet/<int:user_id>/<int:planet_id>', methods=['POST'])
-def add_favorite_planet(user_id, planet_id):
-    user = get_user_by_id(user_id)
-    if not user:
+    if not user_exists:
         return jsonify({"message": "User not found"}), 404
+    if not target_exists:
+        return jsonify({"message": not_found}), 404
+    return None
 
-    planet = Planets.query.get(planet_id)
-    if not planet:
-        return jsonify({"message": "Planet not found"}), 404
 
-    if planet in user.favorite_planets:
-        return jsonify({"message": "Planet already in favorites"}), 400
+def favorite_exists_statement(user_id, model, target_id):
+    return db.select(
+        db.select(User.id).filter_by(id=user_id).exists(),
+        db.select(model.id).filter_by(id=target_id).exists()
+    )
 
-    user.favorite_planets.append(planet)
-    db.session.commit()
-    return jsonify({"message": "Planet added to favorites"}), 201
 
+def favorite_insert_statement(table, column, user_id, target_id, dialect=None):
+    # A single INSERT on the association table; the composite primary key
+    # rejects duplicates and the foreign keys reject unknown ids
+    return dialect_insert(table, dialect).values(
+        user_id=user_id, **{column: target_id}
+    ).on_conflict_do_nothing()
 
-@app.route('/favorite/planet/<int:user_id>/<int:planet_id>', methods=['DELETE'])
-def delete_favorite_planet(user_id, planet_id):
 
-    user = get_user_by_id(user_id)
+def favorite_delete_statement(table, column, user_id, target_id):
+    return db.delete(table).where(
+        table.c.user_id == user_id, table.c[column] == target_id)
 
-    if not user:
-        return jsonify({"message": "User not found"}), 404
 
-    planet = Planets.query.get(planet_id)
-    if not planet:
-        return jsonify({"message": "Planet not found"}), 404
+def favorite_count_statement(model, target_id, delta):
+    return (db.update(model.__table__).where(model.__table__.c.id == target_id)
+            .values(favorite_count=model.__table__.c.favorite_count + delta))
+
 
-    if planet not in user.favorite_planets:
-        return jsonify({"message": "Planet is not in user's favorites"}), 400
+def uncount_favorites(user_ids):
+    """Take the favorites of user_ids out of the counters, before the users
+    (and, through ON DELETE CASCADE, their favorites) are deleted.
 
+    Returns {model: [ids whose counter changed]} for cache invalidation.
+    """
+    uncounted = {}
+    for kind, (table, model, _) in FAVORITE_TABLES.items():
+        counters = model.__table__
+        removed = (db.select(db.func.count()).select_from(table)
+                   .where(table.c[kind] == counters.c.id, table.c.user_id.in_(user_ids))
+                   .scalar_subquery())
+        uncounted[model] = db.session.execute(
+            db.update(counters)
+            .where(counters.c.id.in_(db.select(table.c[kind]).where(table.c.user_id.in_(user_ids))))
+            .values(favorite_count=counters.c.favorite_count - removed)
+            .returning(counters.c.id)
+        ).scalars().all()
+    return uncounted
+
+
+def change_favorite_count(column, target_id, delta):
+    # Same transaction as the association row, so the counter never drifts
+    model = FAVORITE_TABLES[column][1]
+    db.session.execute(favorite_count_statement(model, target_id, delta))
+    bump_versions(counts_name(model))
+    return model
+
+
+def add_favorite(table, column, user_id, target_id):
+    result = db.session.execute(
+        favorite_insert_statement(table, column, user_id, target_id))
+    if result.rowcount:
+        model = change_favorite_count(column, target_id, 1)
+        bump_versions(f"favorites:{user_id}")
+    db.session.commit()
+    if result.rowcount:
+        object_cache.invalidate((model.__tablename__, target_id))
+        response_cache.invalidate(f"user:{user_id}:favorites", *count_tags(model, [target_id]))
+    return result.rowcount
+
+
+def delete_favorite(table, column, user_id, target_id):
+    result = db.session.execute(
+        favorite_delete_statement(table, column, user_id, target_id))
+    if result.rowcount:
+        model = change_favorite_count(column, target_id, -1)
+        bump_versions(f"favorites:{user_id}")
+    db.session.commit()
+    if result.rowcount:
+        object_cache.invalidate((model.__tablename__, target_id))
+        response_cache.invalidate(f"user:{user_id}:favorites", *count_tags(model, [target_id]))
+    return result.rowcount
+
+
+@app.route('/favorite/planet/<int:user_id>/<int:planet_id>', methods=['POST'])
+def add_favorite_planet(user_id, planet_id):
     try:
-        user.favorite_planets.remove(planet)
-        db.session.commit()
+        added = add_favorite(user_planet_favorites, "planet_id", user_id, planet_id)
+    except IntegrityError:
+        db.session.rollback()
+        return favorite_target_missing(user_id, Planets, planet_id, "Planet not found")
+
+    if not added:
+        return jsonify({"message": "Planet already in favorites"}), 400
+    return jsonify({"message": "Planet added to favorites"}), 201
+
+
+@app.route('/favorite/planet/<int:user_id>/<int:planet_id>', methods=['DELETE'])
+def delete_favorite_planet(user_id, planet_id):
+    try:
+        deleted = delete_favorite(user_planet_favorites, "planet_id", user_id, planet_id)
     except Exception as error:
         print(error)
         db.session.rollback()
         return jsonify({"message": "Internal server error"}), 500
+
+    if not deleted:
+        return (favorite_target_missing(user_id, Planets, planet_id, "Planet not found")
+                or (jsonify({"message": "Planet is not in user's favorites"}), 400))
     return jsonify({
         "message": "Planet delete succefully"
     }), 201
@@ -172,63 +556,254 @@ def delete_favorite_planet(user_id, planet_id):
 
 @app.route('/favorite/character/<int:user_id>/<int:character_id>', methods=['POST'])
 def add_favorite_character(user_id, character_id):
-    user = get_user_by_id(user_id)
-    if not user:
-        return jsonify({"message": "User not found"}), 404
-
-    character = People.query.get(character_id)
-    if not character:
-        return jsonify({"message": "Character not found"}), 404
+    try:
+        added = add_favorite(user_people_favorites, "character_id", user_id, character_id)
+    except IntegrityError:
+        db.session.rollback()
+        return favorite_target_missing(user_id, People, character_id, "Character not found")
 
-    if character in user.favorite_people:
+    if not added:
         return jsonify({"message": "Character already in favorites"}), 400
-
-    user.favorite_people.append(character)
-    db.session.commit()
     return jsonify({"message": "Character added to favorites"}), 201
 
 
-@app.route('/favorite/character/<int:user_id>/<int:planet_id>', methods=['DELETE'])
-def delete_favorite_character(user_id, planet_id):
+@app.route('/favorite/character/<int:user_id>/<int:character_id>', methods=['DELETE'])
+def delete_favorite_character(user_id, character_id):
+    try:
+        deleted = delete_favorite(user_people_favorites, "character_id", user_id, character_id)
+    except Exception as error:
+        print(error)
+        db.session.rollback()
+        return jsonify({"message": "Internal server error"}), 500
 
-    user = get_user_by_id(user_id)
+    if not deleted:
+        return (favorite_target_missing(user_id, People, character_id, "Character not found")
+                or (jsonify({"message": "Character is not in user's favorites"}), 400))
+    return jsonify({
+        "message": "Character delete succefully"
+    }), 201
 
-    if not user:
-        return jsonify({"message": "User not found"}), 404
 
-    character = People.query.get(planet_id)
-    if not character:
-        return jsonify({"message": "Character not found"}), 404
+FAVORITE_TABLES = {
+    "planet_id": (user_planet_favorites, Planets, "Planet not found"),
+    "character_id": (user_people_favorites, People, "Character not found"),
+}
 
-    if character not in user.favorite_people:
-        return jsonify({"message": "Character is not in user's favorites"}), 400
+
+def favorites_batch(adding):
+    data = request.json
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        return jsonify({"message": "Body must be an array of objects"}), 400
+    if len(data) > app.config['BULK_MAX_ITEMS']:
+        return jsonify({"message": f"At most {app.config['BULK_MAX_ITEMS']} operations per request"}), 400
+
+    operations = []
+    for item in data:
+        kinds = [kind for kind in FAVORITE_TABLES if kind in item]
+        if (len(kinds) != 1 or type(item.get("user_id")) is not int
+                or type(item[kinds[0]]) is not int):
+            operations.append(None)
+        else:
+            operations.append((kinds[0], item["user_id"], item[kinds[0]]))
+    valid = [op for op in operations if op is not None]
+
+    # One set-based lookup per table instead of one query per operation
+    users = existing_values(User.id, {user_id for _, user_id, _ in valid})
+    targets = {}
+    for kind, (_, model, _) in FAVORITE_TABLES.items():
+        targets[kind] = existing_values(
+            model.id, {target_id for op_kind, _, target_id in valid if op_kind == kind})
+    wanted = {kind: set() for kind in FAVORITE_TABLES}
+    for kind, user_id, target_id in valid:
+        if user_id in users and target_id in targets[kind]:
+            wanted[kind].add((user_id, target_id))
 
     try:
-        user.favorite_people.remove(character)
+        # Only the rows the statements report back changed: a pair that was
+        # already there (or gone), even because of a concurrent request, is
+        # neither counted nor reported as applied
+        changes = {kind: set() for kind in FAVORITE_TABLES}
+        for kind, pairs in wanted.items():
+            table = FAVORITE_TABLES[kind][0]
+            if not pairs:
+                continue
+            if adding:
+                changes[kind].update(tuple(row) for row in db.session.execute(
+                    dialect_insert(table).on_conflict_do_nothing()
+                    .returning(table.c.user_id, table.c[kind]),
+                    [{"user_id": user_id, kind: target_id} for user_id, target_id in pairs]
+                ))
+            else:
+                for batch in chunks(list(pairs), app.config['BULK_CHUNK_SIZE']):
+                    changes[kind].update(tuple(row) for row in db.session.execute(
+                        db.delete(table).where(db.tuple_(table.c.user_id, table.c[kind]).in_(batch))
+                        .returning(table.c.user_id, table.c[kind])))
+            if not changes[kind]:
+                continue
+            # one UPDATE per distinct target, with the net change for it
+            counters = FAVORITE_TABLES[kind][1].__table__
+            deltas = {}
+            for _, target_id in changes[kind]:
+                deltas[target_id] = deltas.get(target_id, 0) + (1 if adding else -1)
+            db.session.execute(
+                db.update(counters).where(counters.c.id == db.bindparam("target_id"))
+                .values(favorite_count=counters.c.favorite_count + db.bindparam("delta")),
+                [{"target_id": target_id, "delta": delta} for target_id, delta in deltas.items()]
+            )
+        touched = sorted({user_id for rows in changes.values() for user_id, _ in rows})
+        if touched:
+            bump_versions(*[f"favorites:{user_id}" for user_id in touched],
+                          *[counts_name(FAVORITE_TABLES[kind][1]) for kind, rows in changes.items() if rows])
         db.session.commit()
     except Exception as error:
         print(error)
         db.session.rollback()
         return jsonify({"message": "Internal server error"}), 500
-    return jsonify({
-        "message": "Character delete succefully"
-    }), 201
+
+    results = []
+    reported = {kind: set() for kind in FAVORITE_TABLES}
+    for op in operations:
+        if op is None:
+            results.append({"status": "invalid", "message": "Each operation needs a user_id and one of planet_id, character_id"})
+            continue
+        kind, user_id, target_id = op
+        result = {"user_id": user_id, kind: target_id}
+        if user_id not in users:
+            result.update(status="not_found", message="User not found")
+        elif target_id not in targets[kind]:
+            result.update(status="not_found", message=FAVORITE_TABLES[kind][2])
+        elif (user_id, target_id) in changes[kind] and (user_id, target_id) not in reported[kind]:
+            # later duplicates of the same pair in this batch are no-ops
+            reported[kind].add((user_id, target_id))
+            result["status"] = "created" if adding else "deleted"
+        else:
+            result["status"] = "exists" if adding else "not_favorite"
+        results.append(result)
+
+    tags = [f"user:{user_id}:favorites" for rows in changes.values() for user_id, _ in rows]
+    for kind, rows in changes.items():
+        model = FAVORITE_TABLES[kind][1]
+        for _, target_id in rows:
+            object_cache.invalidate((model.__tablename__, target_id))
+        if rows:
+            tags += count_tags(model, [target_id for _, target_id in rows])
+    response_cache.invalidate(*tags)
+
+    applied = sum(len(rows) for rows in changes.values())
+    return jsonify({"applied": applied, "results": results}), 200
+
+
+@app.route('/favorites/batch', methods=['POST'])
+def add_favorites_batch():
+    return favorites_batch(adding=True)
+
+
+@app.route('/favorites/batch', methods=['DELETE'])
+def delete_favorites_batch():
+    return favorites_batch(adding=False)
+
+
+FAVORITE_LISTS = {
+    "planets": ("favorite_planets", Planets, Planets.name_of_planets, user_planet_favorites.c.planet_id),
+    "people": ("favorite_people", People, People.name_of_people, user_people_favorites.c.character_id),
+}
+
+
+def favorites_pages(args):
+    """Map each requested favorite list (?type=planets|people) to its (limit, after)."""
+    kinds = list(FAVORITE_LISTS)
+    if "type" in args:
+        if args["type"] not in FAVORITE_LISTS:
+            raise APIException("type must be one of: planets, people", status_code=400)
+        kinds = [args["type"]]
+    return {
+        kind: get_page_args(args, app.config['DEFAULT_PAGE_LIMIT'],
+                            app.config['MAX_PAGE_LIMIT'], cursor=f"{kind}_after")
+        for kind in kinds
+    }
+
+
+def favorites_statement(user_id, pages):
+    # One round trip: a row for the user (so a missing user is told apart from
+    # one without favorites) UNION ALL a keyset page of each favorite list
+    branches = [db.select(
+        db.literal("user").label("type"), User.id.label("id"),
+        db.literal(None, db.String).label("name")
+    ).where(User.id == user_id)]
+
+    for kind, (limit, after) in pages.items():
+        _, model, name, column = FAVORITE_LISTS[kind]
+        page = (db.select(db.literal(kind).label("type"), model.id.label("id"), name.label("name"))
+                .join(column.table, column == model.id)
+                .where(column.table.c.user_id == user_id)
+                .order_by(model.id)
+                .limit(limit + 1))
+        if after is not None:
+            page = page.where(model.id > after)
+        branches.append(db.select(page.subquery()))
+    return db.union_all(*branches)
+
+
+def favorites_payload(user_id, rows, pages):
+    rows = list(rows)
+    if not any(row.type == "user" for row in rows):
+        return None
+
+    payload = {"user_id": user_id}
+    for kind, (limit, _) in pages.items():
+        key, _, name, _ = FAVORITE_LISTS[kind]
+        items = sorted(({"id": row.id, name.key: row.name} for row in rows if row.type == kind),
+                       key=lambda item: item["id"])
+        payload[key] = items[:limit]
+        payload[f"next_{kind}_cursor"] = items[limit - 1]["id"] if len(items) > limit else None
+    return payload
 
 
 @app.route('/favorite/<int:user_id>', methods=['GET'])
+@conditional("favorites:{user_id}", "people", "planets")
+@response_cache.cached("user:{user_id}:favorites", "people", "planets", private=True)
+@coalesced(single_flight)
 def get_user_favorites(user_id):
-    user = get_user_by_id(user_id)
-    if not user:
+    pages = favorites_pages(request.args)
+    rows = db.session.execute(favorites_statement(user_id, pages))
+    payload = favorites_payload(user_id, rows, pages)
+
+    if payload is None:
         return jsonify({"message": "User not found"}), 404
 
-    favorite_planets = [planet.serialize() for planet in user.favorite_planets]
-    favorite_people = [person.serialize() for person in user.favorite_people]
+    return jsonify(payload), 200
 
-    return jsonify({
-        "user_id": user.id,
-        "favorite_planets": favorite_planets,
-        "favorite_people": favorite_people
-    }), 200
+
+def export_authorized():
+    token = app.config['EXPORT_TOKEN']
+    auth = request.authorization
+    return (auth is not None and auth.type == "bearer" and auth.token is not None
+            and hmac.compare_digest(auth.token.encode(), token.encode()))
+
+
+@app.route('/export/<table>', methods=['GET'])
+def export_table(table):
+    if not app.config['EXPORT_TOKEN']:
+        return jsonify({"message": "Export is disabled"}), 404
+    if not export_authorized():
+        return jsonify({"message": "Unauthorized"}), 401, {"WWW-Authenticate": "Bearer"}
+    if table not in EXPORT_TABLES:
+        return jsonify({"message": f"table must be one of: {', '.join(EXPORT_TABLES)}"}), 404
+
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"message": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    min_id, max_id = get_id_range(request.args)
+    stmt = export_statement(table, min_id, max_id)
+
+    def generate():
+        yield export_header(table, export_format)
+        for batch in db.session.execute(stmt).mappings().partitions():
+            yield encode_export_batch(batch, export_format)
+
+    # gzip is negotiated through Accept-Encoding by the Compress extension
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[export_format],
+                    headers={"Cache-Control": "no-store"})
 
 
 @app.route('/character', methods=["POST"])
@@ -239,11 +814,6 @@ def create_character():
     if not all(data.get(field) for field in required_field):
         return jsonify({"message": "field are required: name_of_people"}), 400
 
-    people_exists = db.session.execute(
-        db.select(People).filter_by(name_of_people=data["name_of_people"])).scalar_one_or_none()
-    if people_exists is not None:
-        return jsonify({"message": "Can't create a new character"}), 400
-
     people = People(
         name_of_people=data["name_of_people"],
     )
@@ -252,6 +822,9 @@ def create_character():
 
     try:
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "Can't create a new character"}), 400
     except Exception as error:
         print(error)
         db.session.rollback()
@@ -262,21 +835,45 @@ def create_character():
 
 
 @app.route('/character/<int:id>', methods=['GET'])
+@response_cache.cached("character:{id}")
+@coalesced(single_flight)
 def get_character_by_id(id):
-    character = db.session.execute(
-        db.select(People).filter_by(id=id)
-    ).scalar_one_or_none()
+    character = cached_entity(People, id)
 
     if character is None:
         return jsonify({"message": "character not found"}), 404
 
-    return jsonify(character.serialize()), 200
+    return entity_response(character)
 
 
 @app.route('/people', methods=['GET'])
+@conditional("people", "people:counts")
+@response_cache.cached("people", "people:counts")
+@coalesced(single_flight)
 def get_people():
-    people = db.session.execute(db.select(People)).scalars().all()
-    return jsonify([character.serialize() for character in people]), 200
+    return list_response(People)
+
+
+def popular_statement(model, limit):
+    # Walks ix_<table>_favorite_count backwards; no aggregation per request
+    return (select_serialized(model)
+            .order_by(model.favorite_count.desc(), model.id.desc())
+            .limit(limit))
+
+
+def popular_response(model):
+    limit, _ = get_page_args(request.args, app.config['POPULAR_DEFAULT_LIMIT'],
+                             app.config['MAX_PAGE_LIMIT'])
+    rows = db.session.execute(popular_statement(model, limit)).mappings()
+    return jsonify({"results": [dict(row) for row in rows]}), 200
+
+
+@app.route('/people/popular', methods=['GET'])
+@conditional("people", "people:counts")
+@response_cache.cached("people", "people:counts")
+@coalesced(single_flight)
+def get_popular_people():
+    return popular_response(People)
 
 
 @app.route('/character/<int:id>', methods=['DELETE'])
@@ -310,17 +907,13 @@ def update_character(character_id):
     if not character:
         return jsonify({"message": "character not found"}), 404
 
-    existing_character = db.session.execute(
-        db.select(People).filter_by(name_of_people=data["name_of_people"])
-    ).scalar_one_or_none()
-
-    if existing_character and existing_character.id != character.id:
-        return jsonify({"message": "Another planet with this name already exists"}), 400
-
     character.name_of_people = data["name_of_people"]
 
     try:
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "Another planet with this name already exists"}), 400
     except Exception as error:
         print(error)
         db.session.rollback()
@@ -332,6 +925,139 @@ def update_character(character_id):
     }), 200
 
 
+def valid_name(name, max_length):
+    return isinstance(name, str) and 0 < len(name) <= max_length
+
+
+def bulk_create(model, field, version):
+    data = request.json
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        return jsonify({"message": "Body must be an array of objects"}), 400
+    if len(data) > app.config['BULK_MAX_ITEMS']:
+        return jsonify({"message": f"At most {app.config['BULK_MAX_ITEMS']} items per request"}), 400
+
+    column = getattr(model, field)
+    max_length = column.type.length
+    existing = existing_values(
+        column, {item.get(field) for item in data if valid_name(item.get(field), max_length)})
+
+    results = []
+    to_insert = []
+    seen = set()
+    for item in data:
+        name = item.get(field)
+        if not valid_name(name, max_length):
+            results.append({"status": "invalid",
+                            "message": f"{field} must be a non-empty string of at most {max_length} characters"})
+        elif name in existing or name in seen:
+            results.append({"status": "conflict", field: name})
+        else:
+            seen.add(name)
+            results.append({"status": "created", field: name})
+            to_insert.append({field: name})
+
+    try:
+        created = {}
+        if to_insert:
+            # a concurrent request may have taken a name since the lookup;
+            # the unique index skips those rows and they are not returned
+            rows = db.session.execute(
+                dialect_insert(model.__table__).on_conflict_do_nothing()
+                .returning(model.id, column),
+                to_insert
+            )
+            created = {name: id for id, name in rows}
+            if created:
+                bump_versions(version)
+        db.session.commit()
+    except Exception as error:
+        print(error)
+        db.session.rollback()
+        return jsonify({"message": "Internal server error"}), 500
+    if created:
+        response_cache.invalidate(*cache_tags(model))
+
+    for result in results:
+        if result["status"] == "created":
+            if result[field] in created:
+                result["id"] = created[result[field]]
+            else:
+                result["status"] = "conflict"
+    return jsonify({"created": len(created), "results": results}), 201
+
+
+def bulk_delete(model, version):
+    ids = request.json
+    if not isinstance(ids, list) or not all(type(id) is int for id in ids):
+        return jsonify({"message": "Body must be an array of ids"}), 400
+    if len(ids) > app.config['BULK_MAX_ITEMS']:
+        return jsonify({"message": f"At most {app.config['BULK_MAX_ITEMS']} ids per request"}), 400
+    ids = list(dict.fromkeys(ids))
+
+    try:
+        deleted = set()
+        uncounted = {}
+        for batch in chunks(ids, app.config['BULK_CHUNK_SIZE']):
+            if model is User:
+                for target, target_ids in uncount_favorites(batch).items():
+                    uncounted.setdefault(target, set()).update(target_ids)
+            # One DELETE per chunk; ON DELETE CASCADE clears the favorites
+            deleted.update(db.session.execute(
+                db.delete(model.__table__).where(model.__table__.c.id.in_(batch))
+                .returning(model.__table__.c.id)).scalars())
+        if deleted:
+            names = [version] + [counts_name(target) for target, target_ids in uncounted.items() if target_ids]
+            if model is User:
+                names += [f"favorites:{id}" for id in sorted(deleted)]
+            bump_versions(*names)
+        db.session.commit()
+    except Exception as error:
+        print(error)
+        db.session.rollback()
+        return jsonify({"message": "Internal server error"}), 500
+
+    for id in deleted:
+        object_cache.invalidate((model.__tablename__, id))
+    tags = cache_tags(model, deleted) if deleted else []
+    if model is User:
+        tags += [f"user:{id}:favorites" for id in deleted]
+    for target, target_ids in uncounted.items():
+        for target_id in target_ids:
+            object_cache.invalidate((target.__tablename__, target_id))
+        if target_ids:
+            tags += count_tags(target, target_ids)
+    response_cache.invalidate(*tags)
+    return jsonify({
+        "deleted": [id for id in ids if id in deleted],
+        "missing": [id for id in ids if id not in deleted]
+    }), 200
+
+
+@app.route('/users', methods=['DELETE'])
+def delete_users_bulk():
+    return bulk_delete(User, "user")
+
+
+@app.route('/characters', methods=['DELETE'])
+def delete_characters_bulk():
+    return bulk_delete(People, "people")
+
+
+@app.route('/planets', methods=['DELETE'])
+def delete_planets_bulk():
+    return bulk_delete(Planets, "planets")
+
+
+@app.route('/characters/bulk', methods=["POST"])
+def create_characters_bulk():
+    return bulk_create(People, "name_of_people", "people")
+
+
+@app.route('/planets/bulk', methods=["POST"])
+def create_planets_bulk():
+    return bulk_create(Planets, "name_of_planets", "planets")
+
+
 @app.route('/planet', methods=["POST"])
 def create_planet():
     data = request.json
@@ -340,11 +1066,6 @@ def create_planet():
     if not all(data.get(field) for field in required_field):
         return jsonify({"message": "field are required: name_of_planets"}), 400
 
-    people_exists = db.session.execute(
-        db.select(Planets).filter_by(name_of_planets=data["name_of_planets"])).scalar_one_or_none()
-    if people_exists is not None:
-        return jsonify({"message": "Can't create a new character"}), 400
-
     planet = Planets(
         name_of_planets=data["name_of_planets"],
     )
@@ -353,6 +1074,9 @@ def create_planet():
 
     try:
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "Can't create a new character"}), 400
     except Exception as error:
         print(error)
         db.session.rollback()
@@ -363,21 +1087,31 @@ def create_planet():
 
 
 @app.route('/planet/<int:id>', methods=['GET'])
+@response_cache.cached("planet:{id}")
+@coalesced(single_flight)
 def get_planet_by_id(id):
-    planet = db.session.execute(
-        db.select(Planets).filter_by(id=id)
-    ).scalar_one_or_none()
+    planet = cached_entity(Planets, id)
 
     if planet is None:
         return jsonify({"message": "character not found"}), 404
 
-    return jsonify(planet.serialize()), 200
+    return entity_response(planet)
 
 
 @app.route('/planets', methods=['GET'])
+@conditional("planets", "planets:counts")
+@response_cache.cached("planets", "planets:counts")
+@coalesced(single_flight)
 def get_planets():
-    planets = db.session.execute(db.select(Planets)).scalars().all()
-    return jsonify([planet.serialize() for planet in planets]), 200
+    return list_response(Planets)
+
+
+@app.route('/planets/popular', methods=['GET'])
+@conditional("planets", "planets:counts")
+@response_cache.cached("planets", "planets:counts")
+@coalesced(single_flight)
+def get_popular_planets():
+    return popular_response(Planets)
 
 
 @app.route('/planet/<int:id>', methods=['DELETE'])
@@ -411,17 +1145,13 @@ def update_planet(planet_id):
     if not planet:
         return jsonify({"message": "Planet not found"}), 404
 
-    existing_planet = db.session.execute(
-        db.select(Planets).filter_by(name_of_planets=data["name_of_planets"])
-    ).scalar_one_or_none()
-
-    if existing_planet and existing_planet.id != planet.id:
-        return jsonify({"message": "Another planet with this name already exists"}), 400
-
     planet.name_of_planets = data["name_of_planets"]
 
     try:
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "Another planet with this name already exists"}), 400
     except Exception as error:
         print(error)
         db.session.rollback()
@@ -432,6 +1162,27 @@ def update_planet(planet_id):
         "message": "Planet updated successfully"
     }), 200
 
+@app.cli.command("reconcile-favorite-counts")
+def reconcile_favorite_counts():
+    """Recompute favorite_count from the association tables where it drifted."""
+    for kind, (table, model, _) in FAVORITE_TABLES.items():
+        counters = model.__table__
+        actual = (db.select(db.func.count()).select_from(table)
+                  .where(table.c[kind] == counters.c.id).scalar_subquery())
+        fixed = db.session.execute(
+            db.update(counters).where(counters.c.favorite_count != actual)
+            .values(favorite_count=actual).returning(counters.c.id)
+        ).scalars().all()
+        if fixed:
+            bump_versions(counts_name(model))
+        db.session.commit()
+        for id in fixed:
+            object_cache.invalidate((model.__tablename__, id))
+        if fixed:
+            response_cache.invalidate(*count_tags(model, fixed))
+        click.echo(f"{model.__tablename__}: fixed {len(fixed)} counters")
+
+
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=PORT, debug=False)
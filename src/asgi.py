@@ -0,0 +1,365 @@
+"""
+ASGI entry point. The read endpoints and the favorites routes run on an
+async SQLAlchemy engine; every other route is handed to the Flask app, so
+the two entry points serve the same API with the same responses.
+
+    uvicorn asgi:application --app-dir ./src
+"""
+import os
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+from app import (app as flask_app, object_cache, response_cache, CACHE_TAGS, counts_name, count_tags, entity_entry,
+                 keyset_statement, keyset_payload, ids_payload, stream_statement, encode_stream_batch,
+                 favorite_exists_statement, favorite_insert_statement,
+                 favorite_delete_statement, favorite_count_statement, favorites_pages,
+                 favorites_statement, favorites_payload)
+from models import select_serialized, User, People, Planets, user_planet_favorites, user_people_favorites
+from replica import STICKY_COOKIE
+from response_cache import cache_key
+from search import get_search_args, search_statement, search_payload
+from utils import APIException, get_page_args, get_id_list
+from versions import bump_statements, versions_statement, etag_for
+
+
+def async_url(url):
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+
+def create_engine(url):
+    # The sync pool class and psycopg2 connect_args do not apply to async drivers
+    options = {key: value for key, value in flask_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).items()
+               if key not in ("poolclass", "connect_args")}
+    statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and url.startswith("postgresql"):
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(int(statement_timeout))}}
+
+    engine = create_async_engine(async_url(url), **options)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine.sync_engine, "connect")
+        def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+    return engine
+
+
+primary = async_sessionmaker(create_engine(flask_app.config['SQLALCHEMY_DATABASE_URI']),
+                             expire_on_commit=False)
+replica = primary
+if "replica" in flask_app.config.get('SQLALCHEMY_BINDS', {}):
+    replica = async_sessionmaker(create_engine(flask_app.config['SQLALCHEMY_BINDS']["replica"]),
+                                 expire_on_commit=False)
+
+
+def read_session(request):
+    return primary if STICKY_COOKIE in request.cookies else replica
+
+
+def best_mimetype(request):
+    return parse_accept_header(request.headers.get("accept"), MIMEAccept).best
+
+
+def json_response(payload, status_code=200, etag=None):
+    headers = {"ETag": f'"{etag}"'} if etag else None
+    return Response(flask_app.json.dumps(payload) + "\n", status_code=status_code,
+                    media_type="application/json", headers=headers)
+
+
+def not_modified(request, etag):
+    if parse_etags(request.headers.get("if-none-match")).contains(etag):
+        return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+    return None
+
+
+def write_response(payload, status_code):
+    response = json_response(payload, status_code)
+    if status_code < 400 and replica is not primary:
+        response.set_cookie(STICKY_COOKIE, "1", max_age=flask_app.config['REPLICA_STICKY_SECONDS'],
+                            httponly=True, samesite="lax")
+    return response
+
+
+async def current_etag(session, request, names):
+    versions = dict((await session.execute(versions_statement(names))).all())
+    full_path = f"{request.url.path}?{request.url.query}"
+    return etag_for(versions, names, full_path, best_mimetype(request)), versions
+
+
+def cache_control(response, private=False):
+    # Same headers as the Flask routes behind @response_cache.cached
+    if response.status_code in (200, 304) and "cache-control" not in response.headers:
+        response.headers["Cache-Control"] = response_cache.cache_control(private)
+    return response
+
+
+async def shared_cached(request, tags, versions, build):
+    """Serve build(sessions, filling) through the Flask app's shared cache.
+
+    Entries are shared with the Flask routes: same keys, tags and rules.
+    """
+    if response_cache.backend is None:
+        return await build(read_session(request), False)
+
+    key = cache_key(request.url.path, request.query_params.multi_items(), best_mimetype(request))
+    entry, generations = await run_in_threadpool(response_cache.lookup, key, tags, versions)
+    if generations is None:
+        return await build(read_session(request), False)
+
+    if entry is not None:
+        status, headers, body = entry
+        response = Response(body, status_code=status, headers=dict(headers))
+        response.headers["X-Cache"] = "HIT"
+        etag = response.headers.get("etag")
+        if etag and status == 200:
+            return not_modified(request, etag.strip('"')) or response
+        return response
+
+    # built on the primary, which the replica may lag, and without the
+    # per-worker object cache, as on the Flask side
+    response = await build(primary, True)
+    if (response.status_code == 200 and not isinstance(response, StreamingResponse)
+            and "set-cookie" not in response.headers):
+        await run_in_threadpool(response_cache.store, key, generations, versions, response.status_code,
+                                list(response.headers.items()), response.body)
+    response.headers["X-Cache"] = "MISS"
+    return response
+
+
+async def list_response(request, model, names, tags, private=False):
+    async with read_session(request)() as session:
+        tag, versions = await current_etag(session, request, names)
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cache_control(cached, private)
+
+    async def build(sessions, filling):
+        ids = get_id_list(request.query_params, flask_app.config['MAX_IDS_PER_REQUEST'])
+        if (ids is None and "q" not in request.query_params
+                and (request.query_params.get("stream") == "1"
+                     or best_mimetype(request) == "application/x-ndjson")):
+            return stream_response(request, model, tag)
+
+        async with sessions() as session:
+            if ids is not None:
+                rows = (await session.execute(
+                    select_serialized(model).where(model.id.in_(ids)))).mappings()
+                return json_response(ids_payload(rows, ids))
+
+            if "q" in request.query_params:
+                q, limit, after = get_search_args(request.query_params, flask_app.config['DEFAULT_PAGE_LIMIT'],
+                                                  flask_app.config['MAX_PAGE_LIMIT'])
+                stmt = search_statement(model, q, limit, after, session.bind.dialect.name)
+                rows = (await session.execute(stmt)).mappings()
+                return json_response(search_payload(rows, limit))
+
+            limit, after = get_page_args(request.query_params, flask_app.config['DEFAULT_PAGE_LIMIT'],
+                                         flask_app.config['MAX_PAGE_LIMIT'])
+            rows = (await session.execute(keyset_statement(model, limit, after))).mappings().all()
+            return json_response(keyset_payload(rows, limit))
+
+    response = await shared_cached(request, tags, versions, build)
+    if response.status_code == 200:
+        # like @conditional, outside the cache: the ETag follows the versions
+        response.headers["ETag"] = f'"{tag}"'
+    return cache_control(response, private)
+
+
+def stream_response(request, model, tag):
+    ndjson = best_mimetype(request) == "application/x-ndjson"
+
+    async def generate():
+        first = True
+        if not ndjson:
+            yield "["
+        async with read_session(request)() as session:
+            result = await session.stream(stream_statement(model))
+            async for batch in result.mappings().partitions():
+                yield encode_stream_batch(batch, ndjson, first)
+                first = False
+        if not ndjson:
+            yield "]"
+
+    media_type = "application/x-ndjson" if ndjson else "application/json"
+    return StreamingResponse(generate(), media_type=media_type, headers={"ETag": f'"{tag}"'})
+
+
+async def entity_response(request, model, id, not_found, private=False):
+    async def build(sessions, filling):
+        key = (model.__tablename__, id)
+        entry = None if filling else object_cache.get(key)
+        if entry is None:
+            async with sessions() as session:
+                row = (await session.execute(
+                    select_serialized(model).where(model.id == id))).mappings().first()
+            if row is None:
+                return json_response({"message": not_found}, 404)
+            entry = entity_entry(dict(row))
+            object_cache.set(key, entry)
+
+        payload, tag = entry
+        return not_modified(request, tag) or json_response(payload, etag=tag)
+
+    entity_tag = CACHE_TAGS[model.__tablename__][1]
+    response = await shared_cached(request, [f"{entity_tag}:{id}"], None, build)
+    return cache_control(response, private)
+
+
+async def get_users(request):
+    return await list_response(request, User, ["user"], ["users"], private=True)
+
+
+async def get_people(request):
+    return await list_response(request, People, ["people", "people:counts"], ["people", "people:counts"])
+
+
+async def get_planets(request):
+    return await list_response(request, Planets, ["planets", "planets:counts"], ["planets", "planets:counts"])
+
+
+async def get_user_by_id(request):
+    return await entity_response(request, User, request.path_params["id"], "User not found", private=True)
+
+
+async def get_character_by_id(request):
+    return await entity_response(request, People, request.path_params["id"], "character not found")
+
+
+async def get_planet_by_id(request):
+    return await entity_response(request, Planets, request.path_params["id"], "character not found")
+
+
+async def get_user_favorites(request):
+    user_id = request.path_params["user_id"]
+    async with read_session(request)() as session:
+        tag, versions = await current_etag(session, request, [f"favorites:{user_id}", "people", "planets"])
+    cached = not_modified(request, tag)
+    if cached is not None:
+        return cache_control(cached, private=True)
+
+    async def build(sessions, filling):
+        pages = favorites_pages(request.query_params)
+        async with sessions() as session:
+            rows = await session.execute(favorites_statement(user_id, pages))
+            payload = favorites_payload(user_id, rows, pages)
+        if payload is None:
+            return json_response({"message": "User not found"}, 404)
+        return json_response(payload)
+
+    response = await shared_cached(request, [f"user:{user_id}:favorites", "people", "planets"], versions, build)
+    if response.status_code == 200:
+        response.headers["ETag"] = f'"{tag}"'
+    return cache_control(response, private=True)
+
+
+FAVORITE_ROUTES = {
+    "planet": (user_planet_favorites, "planet_id", Planets, "Planet"),
+    "character": (user_people_favorites, "character_id", People, "Character"),
+}
+
+
+async def favorite_missing(session, user_id, model, target_id, label):
+    user_exists, target_exists = (await session.execute(
+        favorite_exists_statement(user_id, model, target_id))).one()
+    if not user_exists:
+        return json_response({"message": "User not found"}, 404)
+    if not target_exists:
+        return json_response({"message": f"{label} not found"}, 404)
+    return None
+
+
+async def change_favorite(request, kind):
+    table, column, model, label = FAVORITE_ROUTES[kind]
+    user_id = request.path_params["user_id"]
+    target_id = request.path_params["target_id"]
+    adding = request.method == "POST"
+
+    async with primary() as session:
+        dialect = session.bind.dialect.name
+        if adding:
+            stmt = favorite_insert_statement(table, column, user_id, target_id, dialect)
+        else:
+            stmt = favorite_delete_statement(table, column, user_id, target_id)
+        try:
+            result = await session.execute(stmt)
+            if result.rowcount:
+                await session.execute(favorite_count_statement(model, target_id, 1 if adding else -1))
+                for name in (counts_name(model), f"favorites:{user_id}"):
+                    for stmt in bump_statements(name, dialect):
+                        await session.execute(stmt)
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return await favorite_missing(session, user_id, model, target_id, label)
+        except Exception as error:
+            print(error)
+            await session.rollback()
+            return json_response({"message": "Internal server error"}, 500)
+
+        if result.rowcount:
+            object_cache.invalidate((model.__tablename__, target_id))
+            # the Flask routes behind this app serve from the shared cache
+            await run_in_threadpool(response_cache.invalidate, f"user:{user_id}:favorites",
+                                    *count_tags(model, [target_id]))
+            if adding:
+                return write_response({"message": f"{label} added to favorites"}, 201)
+            return write_response({"message": f"{label} delete succefully"}, 201)
+
+        missing = await favorite_missing(session, user_id, model, target_id, label)
+        if missing is not None:
+            return missing
+        if adding:
+            return json_response({"message": f"{label} already in favorites"}, 400)
+        return json_response({"message": f"{label} is not in user's favorites"}, 400)
+
+
+async def change_favorite_planet(request):
+    return await change_favorite(request, "planet")
+
+
+async def change_favorite_character(request):
+    return await change_favorite(request, "character")
+
+
+async def handle_api_exception(request, error):
+    return json_response(error.to_dict(), error.status_code)
+
+
+application = Starlette(
+    routes=[
+        Route("/users", get_users, methods=["GET"]),
+        Route("/user/{id:int}", get_user_by_id, methods=["GET"]),
+        Route("/people", get_people, methods=["GET"]),
+        Route("/character/{id:int}", get_character_by_id, methods=["GET"]),
+        Route("/planets", get_planets, methods=["GET"]),
+        Route("/planet/{id:int}", get_planet_by_id, methods=["GET"]),
+        Route("/favorite/{user_id:int}", get_user_favorites, methods=["GET"]),
+        Route("/favorite/planet/{user_id:int}/{target_id:int}", change_favorite_planet,
+              methods=["POST", "DELETE"]),
+        Route("/favorite/character/{user_id:int}/{target_id:int}", change_favorite_character,
+              methods=["POST", "DELETE"]),
+        # Everything else is still served by the Flask app
+        Mount("/", app=WsgiToAsgi(flask_app)),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(GZipMiddleware, minimum_size=flask_app.config['COMPRESS_MIN_SIZE'],
+                   compresslevel=flask_app.config['COMPRESS_LEVEL']),
+    ],
+    exception_handlers={APIException: handle_api_exception},
+)
@@ -0,0 +1,97 @@
+import gzip
+import zlib
+from flask import request
+from cache import ObjectCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "text/html",
+    "text/plain",
+    "text/csv",
+}
+
+
+class Compress:
+    """Compresses responses with brotli or gzip, negotiated via Accept-Encoding.
+
+    Bodies that carry an ETag are only compressed once: the compressed bytes
+    are cached under (ETag, encoding), and the ETags change whenever the
+    underlying table is written, so stale entries are simply never hit again.
+    """
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+        app.config.setdefault("COMPRESS_LEVEL", 6)
+        app.config.setdefault("COMPRESS_BROTLI_QUALITY", 5)
+        app.config.setdefault("COMPRESS_CACHE_SIZE", 256)
+        self.app = app
+        self.cache = ObjectCache(maxsize=app.config["COMPRESS_CACHE_SIZE"], ttl=3600)
+        app.after_request(self.after_request)
+
+    def choose_encoding(self):
+        offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+        return request.accept_encodings.best_match(offered)
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.app.config["COMPRESS_BROTLI_QUALITY"])
+        return gzip.compress(data, compresslevel=self.app.config["COMPRESS_LEVEL"], mtime=0)
+
+    def compress_stream(self, chunks):
+        # gzip container (wbits=31) written incrementally, one chunk at a time
+        compressor = zlib.compressobj(self.app.config["COMPRESS_LEVEL"], zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def after_request(self, response):
+        if (response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or "Content-Encoding" in response.headers):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            if encoding != "gzip":
+                encoding = "gzip" if request.accept_encodings["gzip"] else None
+            if encoding is None:
+                return response
+            response.response = self.compress_stream(response.response)
+            response.headers["Content-Encoding"] = "gzip"
+            response.headers.pop("Content-Length", None)
+            return response
+
+        data = response.get_data()
+        if len(data) < self.app.config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        etag, _ = response.get_etag()
+        key = (etag, encoding)
+        body = self.cache.get(key) if etag else None
+        if body is None:
+            body = self.compress(data, encoding)
+            if etag:
+                self.cache.set(key, body)
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,207 @@
+"""
+Streams a SWAPI-style dump of people or planets into the database.
+
+    flask import-swapi people people.ndjson --chunk-size 5000
+    flask import-swapi planets planets.json --resume
+
+The file is read incrementally, so its size does not matter: NDJSON one
+record per line, or JSON that is either a bare array of records or a SWAPI
+page ({"count": ..., "results": [...]}). Records are matched on their name,
+so importing the same file twice is harmless. Progress is saved to
+<file>.progress after every committed chunk and --resume carries on from it.
+"""
+import csv
+import io
+import json
+import os
+import re
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import db, dialect_insert, People, Planets
+from versions import bump_statements
+
+IMPORT_TARGETS = {
+    "people": (People, "name_of_people"),
+    "planets": (Planets, "name_of_planets"),
+}
+READ_SIZE = 1 << 16
+RESULTS_ARRAY = re.compile(r'"results"\s*:\s*\[')
+
+
+def iter_ndjson(stream):
+    loads = current_app.json.loads
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield loads(line)
+
+
+def iter_json_array(stream):
+    """Yield the records of a JSON array one at a time, READ_SIZE characters at a time."""
+    decoder = json.JSONDecoder()
+    buffer = stream.read(READ_SIZE)
+    position = len(buffer) - len(buffer.lstrip())
+
+    if buffer[position:position + 1] == "[":
+        position += 1
+    elif buffer[position:position + 1] == "{":
+        match = RESULTS_ARRAY.search(buffer)
+        while match is None:
+            more = stream.read(READ_SIZE)
+            if not more:
+                raise click.ClickException("Expected a JSON array or an object with a results array")
+            buffer += more
+            match = RESULTS_ARRAY.search(buffer)
+        position = match.end()
+    else:
+        raise click.ClickException("Expected a JSON array or an object with a results array")
+
+    while True:
+        # skip the whitespace and commas between records
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position == len(buffer):
+            more = stream.read(READ_SIZE)
+            if not more:
+                raise click.ClickException("Unexpected end of file inside the array")
+            buffer, position = more, 0
+            continue
+        if buffer[position] == "]":
+            return
+
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # the record runs past the end of the buffer
+            more = stream.read(READ_SIZE)
+            if not more:
+                raise click.ClickException("Unexpected end of file inside a record")
+            buffer, position = buffer[position:] + more, 0
+            continue
+        yield record
+
+
+def record_name(record, field):
+    # swapi.tech nests the fields under "properties"; swapi.dev does not
+    if isinstance(record, dict):
+        record = record.get("properties", record)
+        name = record.get(field) or record.get("name")
+        if isinstance(name, str) and name.strip():
+            return name.strip()[:120]
+    return None
+
+
+def insert_sqlite(connection, model, field, names):
+    result = connection.execute(
+        dialect_insert(model.__table__, "sqlite").on_conflict_do_nothing(),
+        [{field: name} for name in names])
+    return result.rowcount
+
+
+def insert_postgresql(connection, model, field, names):
+    # COPY cannot skip conflicts, so it fills a staging table that a single
+    # INSERT ... SELECT ... ON CONFLICT moves into the real one
+    table = model.__tablename__
+    connection.exec_driver_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS swapi_import (name text) ON COMMIT DELETE ROWS")
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([name] for name in names)
+    buffer.seek(0)
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert("COPY swapi_import (name) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    result = connection.exec_driver_sql(
+        f"INSERT INTO {table} ({field}) SELECT DISTINCT name FROM swapi_import "
+        f"ON CONFLICT ({field}) DO NOTHING")
+    return result.rowcount
+
+
+INSERTERS = {
+    "sqlite": insert_sqlite,
+    "postgresql": insert_postgresql,
+}
+
+
+def read_progress(path):
+    try:
+        with open(path) as progress:
+            return json.load(progress)["records"]
+    except FileNotFoundError:
+        return 0
+
+
+def write_progress(path, records):
+    # write-then-rename, so an interrupted run never leaves a torn file
+    with open(path + ".tmp", "w") as progress:
+        json.dump({"records": records}, progress)
+    os.replace(path + ".tmp", path)
+
+
+@click.command("import-swapi")
+@click.argument("target", type=click.Choice(list(IMPORT_TARGETS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["auto", "json", "ndjson"]), default="auto",
+              help="auto picks ndjson for .ndjson/.jsonl files and json otherwise.")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=None,
+              help="Records per transaction (IMPORT_CHUNK_SIZE).")
+@click.option("--resume", is_flag=True, help="Skip the records committed by a previous run.")
+@with_appcontext
+def import_swapi(target, path, file_format, chunk_size, resume):
+    """Import people or planets from a SWAPI-style JSON or NDJSON dump."""
+    model, field = IMPORT_TARGETS[target]
+    chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+    if file_format == "auto":
+        file_format = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "json"
+
+    engine = db.engine
+    insert = INSERTERS.get(engine.dialect.name)
+    if insert is None:
+        raise click.ClickException(f"Importing is not supported on {engine.dialect.name}")
+
+    progress_path = path + ".progress"
+    skip = read_progress(progress_path) if resume else 0
+    if skip:
+        click.echo(f"Resuming after {skip} records")
+
+    read = inserted = 0
+    started = time.perf_counter()
+
+    def flush(names):
+        nonlocal inserted
+        with engine.begin() as connection:
+            inserted += insert(connection, model, field, names)
+            for stmt in bump_statements(target, engine.dialect.name):
+                connection.execute(stmt)
+        if "response_cache" in current_app.extensions:
+            current_app.extensions["response_cache"].invalidate(target)
+        write_progress(progress_path, read)
+        elapsed = time.perf_counter() - started
+        click.echo(f"{read} records read, {inserted} inserted, "
+                   f"{(read - skip) / elapsed:,.0f} rows/s")
+
+    with open(path, encoding="utf-8") as stream:
+        records = iter_ndjson(stream) if file_format == "ndjson" else iter_json_array(stream)
+        names = []
+        for record in records:
+            read += 1
+            if read <= skip:
+                continue
+            name = record_name(record, field)
+            if name is not None:
+                names.append(name)
+            if read % chunk_size == 0 and names:
+                flush(names)
+                names = []
+        if names:
+            flush(names)
+
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Done: {read - skip} records in {elapsed:.1f}s, {inserted} new {target}")
@@ -0,0 +1,50 @@
+import datetime
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Encodes with orjson when it is installed and with the stdlib otherwise.
+
+    Datetimes come out as ISO 8601 strings on both paths.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime.date, datetime.datetime)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_options(self, sort_keys, pretty):
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        # anything beyond sort_keys needs the stdlib encoder
+        if orjson is None or set(kwargs) - {"sort_keys"}:
+            return super().dumps(obj, **kwargs)
+        option = self._orjson_options(kwargs.get("sort_keys", self.sort_keys), False)
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        option = self._orjson_options(self.sort_keys, pretty)
+        body = orjson.dumps(obj, default=self.default, option=option)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
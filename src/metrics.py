@@ -0,0 +1,104 @@
+import os
+import time
+from flask import Response, g, has_request_context, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram,
+                               REGISTRY, generate_latest, multiprocess)
+from sqlalchemy import event
+import pool
+import singleflight
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency", ["method", "endpoint"])
+REQUEST_COUNT = Counter(
+    "http_requests_total", "Requests by status", ["method", "endpoint", "status"])
+REQUEST_SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements", "SQL statements executed per request", ["endpoint"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100, float("inf")))
+REQUEST_SQL_SECONDS = Histogram(
+    "http_request_sql_seconds", "Total SQL time per request", ["endpoint"])
+REQUESTS_COALESCED = Counter(
+    "http_requests_coalesced_total", "GET requests answered with another in-flight request's result",
+    ["endpoint"])
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, float("inf")))
+
+
+# Callables notified with every statement, failed ones included, and its
+# duration in seconds, e.g. the SQL inspector
+statement_observers = []
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which goes away with the statement, so
+    # nothing is left behind when the statement fails
+    context.query_start = time.perf_counter()
+
+
+def record_statement(context, statement, parameters, executemany):
+    start = vars(context).pop("query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context() and "sql_statements" in g:
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
+    for observe in statement_observers:
+        observe(statement, parameters, executemany, elapsed)
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_statement(context, statement, parameters, executemany)
+
+
+def handle_error(exception_context):
+    # after_cursor_execute is skipped for a statement that raises; it still
+    # counts towards the request
+    context = exception_context.execution_context
+    if context is not None:
+        record_statement(context, exception_context.statement, exception_context.parameters,
+                         context.executemany)
+
+
+def registry():
+    # Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+    # and a scrape of any worker reports the sum over all of them
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def setup_metrics(app, db):
+    """Record per-endpoint latency, status and SQL usage, served at /metrics."""
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", after_cursor_execute)
+            event.listen(engine, "handle_error", handle_error)
+    pool.checkout_observers.append(POOL_CHECKOUT_WAIT.observe)
+    singleflight.coalesce_observers.append(
+        lambda endpoint: REQUESTS_COALESCED.labels(endpoint).inc())
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if "request_start" not in g:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_LATENCY.labels(request.method, endpoint).observe(
+            time.perf_counter() - g.request_start)
+        REQUEST_COUNT.labels(request.method, endpoint, response.status_code).inc()
+        REQUEST_SQL_STATEMENTS.labels(endpoint).observe(g.sql_statements)
+        REQUEST_SQL_SECONDS.labels(endpoint).observe(g.sql_seconds)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(generate_latest(registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -1,28 +1,72 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from sqlalchemy import String, Boolean, ForeignKey
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, backref
 from sqlalchemy import DateTime
 import datetime
 from sqlalchemy import Text
 from typing import List
 from sqlalchemy import Table
 from sqlalchemy import Column
+from sqlalchemy import Index
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import sqlite3
 
-db = SQLAlchemy()
+class RoutingSession(Session):
+    """Sends SELECTs to the "replica" bind while the current request allows it."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and clause is not None and clause.is_select
+                and not self._flushing and "replica" in self._db.engines
+                and has_app_context() and g.get("read_replica")):
+            return self._db.engines["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores FOREIGN KEY constraints unless asked on every connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def select_serialized(model):
+    # Only the columns serialize() emits, read as plain row mappings, so list
+    # endpoints skip the identity map and instance state entirely
+    return db.select(*[getattr(model, name) for name in model.serialize_fields])
+
+
+def dialect_insert(table, dialect=None):
+    # INSERT ... ON CONFLICT is only available through the dialect constructs
+    if dialect is None:
+        dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"ON CONFLICT is not supported on {dialect}")
 
 # Tabla de asociación entre usuarios y planetas favoritos
 user_planet_favorites = Table(
     "user_planet_favorites",
     db.Model.metadata,
-    Column("user_id", ForeignKey("user.id"), primary_key=True),
-    Column("planet_id", ForeignKey("planets.id"), primary_key=True)
+    Column("user_id", ForeignKey("user.id", ondelete="CASCADE"), primary_key=True),
+    Column("planet_id", ForeignKey("planets.id", ondelete="CASCADE"), primary_key=True)
 )
 # Tabla de asociación entre usuarios y personas favoritas
 user_people_favorites = Table(
     "user_people_favorites",
     db.Model.metadata,
-    Column("user_id", ForeignKey("user.id"), primary_key=True),
-    Column("character_id", ForeignKey("people.id"), primary_key=True)
+    Column("user_id", ForeignKey("user.id", ondelete="CASCADE"), primary_key=True),
+    Column("character_id", ForeignKey("people.id", ondelete="CASCADE"), primary_key=True)
 )
 
 
@@ -36,14 +80,20 @@ class User(db.Model):
     last_name: Mapped[str] = mapped_column(String(120), nullable=False)
     subscription_date: Mapped[datetime.datetime] = mapped_column(DateTime)
 
+    serialize_fields = ("id", "email", "user_name", "is_active")
+
 
     # Favorite Relationship
+    # passive_deletes: las filas de favoritos las borra el ON DELETE CASCADE,
+    # sin cargar las colecciones al borrar un usuario, planeta o personaje
     favorite_planets: Mapped[List["Planets"]] = relationship(
-        secondary=user_planet_favorites, backref="favorited_by_users"
+        secondary=user_planet_favorites, passive_deletes=True,
+        backref=backref("favorited_by_users", passive_deletes=True)
     )
 
     favorite_people: Mapped[List["People"]] = relationship(
-        secondary=user_people_favorites, backref="favorited_by_users"
+        secondary=user_people_favorites, passive_deletes=True,
+        backref=backref("favorited_by_users", passive_deletes=True)
     )
 
     def __init__(self,email, password, user_name, first_name, last_name):
@@ -65,20 +115,41 @@ class User(db.Model):
 
 class Planets(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
-    name_of_planets: Mapped[str] = mapped_column(String(120), nullable=False)
+    name_of_planets: Mapped[str] = mapped_column(String(120), nullable=False, unique=True, index=True)
+    # Mantenido por los handlers de favoritos; ver reconcile-favorite-counts
+    favorite_count: Mapped[int] = mapped_column(nullable=False, default=0, server_default="0")
+
+    # Sirve el top-N de /planets/popular directamente desde el índice
+    __table_args__ = (Index("ix_planets_favorite_count", "favorite_count", "id"),)
+
+    serialize_fields = ("id", "name_of_planets", "favorite_count")
 
     def serialize(self):
         return {
             "id": self.id,
-            "name_of_planets": self.name_of_planets
+            "name_of_planets": self.name_of_planets,
+            "favorite_count": self.favorite_count
         }
 
 class People(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
-    name_of_people: Mapped[str] = mapped_column(String(120), nullable=False)
+    name_of_people: Mapped[str] = mapped_column(String(120), nullable=False, unique=True, index=True)
+    # Mantenido por los handlers de favoritos; ver reconcile-favorite-counts
+    favorite_count: Mapped[int] = mapped_column(nullable=False, default=0, server_default="0")
+
+    # Sirve el top-N de /people/popular directamente desde el índice
+    __table_args__ = (Index("ix_people_favorite_count", "favorite_count", "id"),)
+
+    serialize_fields = ("id", "name_of_people", "favorite_count")
 
     def serialize(self):
         return {
             "id": self.id,
-            "name_of_people": self.name_of_people
-        }
\ No newline at end of file
+            "name_of_people": self.name_of_people,
+            "favorite_count": self.favorite_count
+        }
+
+# Contador de versiones usado para generar los ETag
+class TableVersion(db.Model):
+    name: Mapped[str] = mapped_column(String(120), primary_key=True)
+    version: Mapped[int] = mapped_column(nullable=False, default=0)
@@ -0,0 +1,28 @@
+from flask import g, request
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+STICKY_COOKIE = "read_primary"
+
+
+def setup_replica(app):
+    """Route read-only requests to the replica bind, when one is configured.
+
+    A client that just wrote gets a short-lived cookie that keeps its reads
+    on the primary, so it never reads from a replica that has not caught up.
+    """
+    if "replica" not in app.config.get("SQLALCHEMY_BINDS", {}):
+        return
+
+    @app.before_request
+    def choose_read_engine():
+        g.read_replica = (request.method in READ_METHODS
+                          and STICKY_COOKIE not in request.cookies)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE, "1",
+                max_age=app.config['REPLICA_STICKY_SECONDS'],
+                httponly=True, samesite="Lax")
+        return response
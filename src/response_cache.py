@@ -0,0 +1,379 @@
+"""
+Shared cache of GET responses, so every gunicorn worker (and every host
+pointed at the same store) serves what any of them has already built.
+
+RESPONSE_CACHE_URL picks the backend; without it nothing is cached:
+
+    memory://                         this process only, meant for tests
+    sqlite:////tmp/response-cache.db  one file shared by the workers of a host
+    redis://:password@localhost:6379/0  anything that speaks the Redis protocol
+
+Entries carry tags such as "people", "planet:42" or "user:7:favorites". Each
+tag has a generation counter in the backend: an entry remembers the
+generations it was built under and is ignored once one of them has moved,
+so invalidating a tag is a single increment however many entries carry it.
+The generations are read before the view runs, so a write that commits
+while a response is being built still invalidates that response. Entries
+also remember the table versions @conditional read for them (its ETag comes
+from those), so a write that has committed but not yet invalidated its tags
+is a miss too, never an old body under a new ETag. For the same reason a
+miss is always built on the primary database, even for a read routed to the
+replica, and without the per-worker object cache (see filling()).
+"""
+import hashlib
+import json
+import socket
+import sqlite3
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlparse, unquote
+
+from flask import current_app, g, request
+
+
+class CacheBackendError(Exception):
+    pass
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            values = []
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and entry[1] is not None and entry[1] < now:
+                    del self._data[key]
+                    entry = None
+                values.append(None if entry is None else entry[0])
+            return values
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def incr_many(self, keys):
+        with self._lock:
+            for key in keys:
+                value, _ = self._data.get(key, (0, None))
+                self._data[key] = (int(value) + 1, None)
+
+
+class SQLiteBackend:
+    """A single SQLite file in WAL mode, one connection per thread."""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        # opened and closed here so a preloading gunicorn master never hands
+        # a live connection down to its workers
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS response_cache "
+                           "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)")
+        connection.close()
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, keys):
+        try:
+            rows = self.connection().execute(
+                f"SELECT key, value FROM response_cache WHERE key IN ({','.join('?' * len(keys))}) "
+                "AND (expires IS NULL OR expires > ?)", [*keys, time.time()]).fetchall()
+        except sqlite3.Error as error:
+            raise CacheBackendError(error)
+        found = dict(rows)
+        return [found.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        try:
+            connection = self.connection()
+            connection.execute(
+                "INSERT INTO response_cache (key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+                (key, value, time.time() + ttl))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                connection.execute("DELETE FROM response_cache WHERE expires < ?", (time.time(),))
+        except sqlite3.Error as error:
+            raise CacheBackendError(error)
+
+    def incr_many(self, keys):
+        try:
+            connection = self.connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT INTO response_cache (key, value, expires) VALUES (?, 1, NULL) "
+                    "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                    [(key,) for key in keys])
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as error:
+            raise CacheBackendError(error)
+
+
+class RedisBackend:
+    """Minimal RESP2 client: pipelined GET/MGET/SET/INCR over one socket per thread."""
+
+    def __init__(self, url, timeout=1.0):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "localhost", parsed.port or 6379)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.database = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        connection = (sock, sock.makefile("rb"))
+        self._local.connection = connection
+        setup = []
+        if self.password is not None:
+            setup.append(("AUTH", self.password))
+        if self.database:
+            setup.append(("SELECT", self.database))
+        if setup:
+            self.execute(*setup)
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    @staticmethod
+    def encode(command):
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def read_reply(self, stream):
+        line = stream.readline()
+        if not line.endswith(b"\r\n"):
+            raise CacheBackendError("connection closed by the server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise CacheBackendError(rest.decode(errors="replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = stream.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self.read_reply(stream) for _ in range(length)]
+        raise CacheBackendError(f"unexpected reply {line!r}")
+
+    def execute(self, *commands):
+        try:
+            sock, stream = getattr(self._local, "connection", None) or self.connect()
+            sock.sendall(b"".join(self.encode(command) for command in commands))
+            replies = [self.read_reply(stream) for _ in commands]
+        except (OSError, CacheBackendError) as error:
+            # a half-read reply leaves the stream out of step: start over
+            self.close()
+            raise CacheBackendError(error)
+        return replies
+
+    def get_many(self, keys):
+        return self.execute(("MGET", *keys))[0]
+
+    def set(self, key, value, ttl):
+        self.execute(("SET", key, value, "PX", int(ttl * 1000)))
+
+    def incr_many(self, keys):
+        self.execute(*[("INCR", key) for key in keys])
+
+
+def create_backend(url):
+    if not url:
+        return None
+    if url.startswith("memory:"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis:", "tcp:")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported RESPONSE_CACHE_URL: {url}")
+
+
+def cache_key(path, args, best_mimetype):
+    # Only responses built from the primary are stored, so reads routed to
+    # the replica and reads that must see the primary share the entries.
+    # Also computed by the ASGI app, which shares them with the Flask routes.
+    parts = (path, tuple(sorted(args)), best_mimetype)
+    return "response:" + hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def request_key():
+    return cache_key(request.path, request.args.items(multi=True), request.accept_mimetypes.best)
+
+
+class ResponseCache:
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        # view name -> whether its responses are private to one user
+        self.endpoints = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RESPONSE_CACHE_TTL", 60)
+        app.config.setdefault("RESPONSE_CACHE_MAX_AGE", 0)
+        self.app = app
+        app.extensions["response_cache"] = self
+        if self.backend is None:
+            self.backend = create_backend(app.config.get("RESPONSE_CACHE_URL"))
+        app.after_request(self.set_cache_control)
+
+    def cache_control(self, private=False):
+        # Browsers and proxies may keep the body but, with the default
+        # max-age of 0, revalidate it against the ETag on every use: only this
+        # cache sees the tag invalidations. Private bodies (emails, a user's
+        # favorites) are kept out of shared proxies altogether.
+        if private:
+            return "private, no-cache"
+        max_age = self.app.config["RESPONSE_CACHE_MAX_AGE"]
+        return f"public, max-age={max_age}" if max_age else "public, no-cache"
+
+    def set_cache_control(self, response):
+        if (request.method == "GET" and request.endpoint in self.endpoints
+                and response.status_code in (200, 304)
+                and "Cache-Control" not in response.headers):
+            response.headers["Cache-Control"] = self.cache_control(self.endpoints[request.endpoint])
+        return response
+
+    def filling(self):
+        """True while a view runs to fill the shared cache: it must read the
+        database rather than a per-worker copy that may predate the tags."""
+        return bool(g.get("response_cache_fill"))
+
+    def failed(self, error):
+        self.errors += 1
+        self.app.logger.warning("response cache unavailable: %s", error)
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying one of tags; call after the write commits."""
+        if self.backend is None or not tags:
+            return
+        try:
+            self.backend.incr_many([f"tag:{tag}" for tag in dict.fromkeys(tags)])
+        except CacheBackendError as error:
+            self.failed(error)
+
+    def lookup(self, key, tags, versions=None):
+        """Return (entry, generations) for key.
+
+        entry is (status, headers, body) when key holds a response built
+        under the current generations of tags and the given table versions.
+        generations is None when the backend is unavailable.
+        """
+        try:
+            stored, *generations = self.backend.get_many([key, *[f"tag:{tag}" for tag in tags]])
+        except CacheBackendError as error:
+            self.failed(error)
+            return None, None
+        generations = [int(generation or 0) for generation in generations]
+
+        if stored is not None:
+            meta, _, body = stored.partition(b"\n")
+            meta = json.loads(meta)
+            if meta["generations"] == generations and meta.get("versions") == versions:
+                self.hits += 1
+                return (meta["status"], meta["headers"], body), generations
+        self.misses += 1
+        return None, generations
+
+    def store(self, key, generations, versions, status, headers, body):
+        meta = json.dumps({"status": status,
+                           "headers": headers,
+                           "generations": generations,
+                           "versions": versions})
+        try:
+            self.backend.set(key, meta.encode() + b"\n" + body, self.app.config["RESPONSE_CACHE_TTL"])
+        except CacheBackendError as error:
+            self.failed(error)
+
+    def cached(self, *tags, private=False):
+        """Serve a GET view from the shared cache.
+
+        tags may use the view arguments as format fields, e.g. "planet:{id}".
+        private marks responses that belong to one user in Cache-Control.
+        """
+        def decorator(view):
+            self.endpoints[view.__name__] = private
+
+            @wraps(view)
+            def wrapper(**kwargs):
+                if self.backend is None:
+                    return view(**kwargs)
+
+                key = request_key()
+                versions = g.get("table_versions")
+                versions = dict(versions) if versions is not None else None
+                entry, generations = self.lookup(key, [tag.format(**kwargs) for tag in tags], versions)
+                if generations is None:
+                    return view(**kwargs)
+
+                if entry is not None:
+                    status, headers, body = entry
+                    response = current_app.response_class(body, status, headers)
+                    response.headers["X-Cache"] = "HIT"
+                    if response.get_etag()[0]:
+                        response.make_conditional(request)
+                    return response
+
+                # Built on the primary even for a read routed to the replica,
+                # which may lag behind the generations just read: the entry
+                # is served to every worker until they move
+                g.read_replica = False
+                g.response_cache_fill = True
+                response = current_app.make_response(view(**kwargs))
+                if (response.status_code == 200 and not response.is_streamed
+                        and "Set-Cookie" not in response.headers):
+                    self.store(key, generations, versions, response.status_code,
+                               list(response.headers.items()), response.get_data())
+                response.headers["X-Cache"] = "MISS"
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
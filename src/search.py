@@ -0,0 +1,117 @@
+from sqlalchemy import event
+from models import db, People, Planets, select_serialized
+from utils import APIException
+
+SEARCH_COLUMNS = {
+    People: "name_of_people",
+    Planets: "name_of_planets",
+}
+# Trigram indexes (FTS5 trigram on SQLite, pg_trgm on Postgres) need 3 characters
+MIN_SUBSTRING_LENGTH = 3
+
+
+def search_ddl(dialect, table, column):
+    """Indexes backing prefix and substring search on table.column.
+
+    SQLite: a NOCASE index for LIKE 'q%' and an external-content FTS5 trigram
+    table kept in sync by triggers. Postgres: a text_pattern_ops index for
+    lower(name) LIKE 'q%' and a pg_trgm GIN index for LIKE '%q%'.
+    """
+    if dialect == "sqlite":
+        fts = f"{table}_fts"
+        return [
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_nocase ON {table} ({column} COLLATE NOCASE)",
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{column}, content='{table}', content_rowid='id', tokenize='trigram')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+            f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+    if dialect == "postgresql":
+        return [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_prefix ON {table} (lower({column}) text_pattern_ops)",
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm ON {table} USING gin (lower({column}) gin_trgm_ops)",
+        ]
+    return []
+
+
+SEARCH_COLUMNS_BY_TABLE = {model.__tablename__: column for model, column in SEARCH_COLUMNS.items()}
+
+
+def create_search_indexes(target, connection, **kw):
+    # db.create_all() does not know about virtual tables or triggers
+    for statement in search_ddl(connection.dialect.name, target.name, SEARCH_COLUMNS_BY_TABLE[target.name]):
+        connection.exec_driver_sql(statement)
+
+
+for searchable in SEARCH_COLUMNS:
+    event.listen(searchable.__table__, "after_create", create_search_indexes)
+
+
+def get_search_args(args, default_limit, max_limit):
+    q = args.get("q", "").strip()
+    if not q or len(q) > 120:
+        raise APIException("q must be between 1 and 120 characters", status_code=400)
+    try:
+        limit = int(args.get("limit", default_limit))
+        after = args.get("after")
+        after = tuple(int(part) for part in after.split(".")) if after else None
+    except ValueError:
+        raise APIException("limit must be an integer and after a cursor from next_cursor", status_code=400)
+
+    if limit < 1 or limit > max_limit:
+        raise APIException(f"limit must be between 1 and {max_limit}", status_code=400)
+    if after is not None and len(after) != 3:
+        raise APIException("after must be a cursor from next_cursor", status_code=400)
+    return q, limit, after
+
+
+def search_statement(model, q, limit, after, dialect):
+    """Prefix matches first, then substring matches; shorter names first within each."""
+    if model not in SEARCH_COLUMNS:
+        raise APIException("Search is not supported on this resource", status_code=400)
+
+    column = getattr(model, SEARCH_COLUMNS[model])
+    needle = q.lower()
+    escaped = needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    if dialect == "sqlite":
+        # LIKE is case-insensitive on SQLite, which lets it use the NOCASE index
+        prefix = column.like(f"{escaped}%", escape="\\")
+    else:
+        prefix = db.func.lower(column).like(f"{escaped}%", escape="\\")
+
+    condition = prefix
+    if len(needle) >= MIN_SUBSTRING_LENGTH:
+        if dialect == "sqlite":
+            fts = f"{model.__tablename__}_fts"
+            matches = db.text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :match").bindparams(
+                match='"' + needle.replace('"', '""') + '"').columns(db.column("rowid"))
+            condition = db.or_(prefix, model.id.in_(matches))
+        else:
+            condition = db.or_(prefix, db.func.lower(column).like(f"%{escaped}%", escape="\\"))
+
+    rank = db.case((prefix, 0), else_=1)
+    length = db.func.length(column)
+    stmt = select_serialized(model).add_columns(
+        rank.label("rank"), length.label("length")).where(condition)
+    if after is not None:
+        stmt = stmt.where(db.tuple_(rank, length, model.id) > db.tuple_(*after))
+    return stmt.order_by(rank, length, model.id).limit(limit + 1)
+
+
+def search_payload(rows, limit):
+    rows = list(rows)
+    results = [{key: value for key, value in row.items() if key not in ("rank", "length")}
+               for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last['rank']}.{last['length']}.{last['id']}"
+    return {"results": results, "next_cursor": next_cursor}
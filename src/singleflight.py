@@ -0,0 +1,123 @@
+import threading
+from functools import wraps
+from flask import current_app, g, request
+
+# Called with the endpoint name each time a request is served from another
+# request's result; metrics.py hooks its counter in here
+coalesce_observers = []
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time.
+
+    Callers that arrive while a computation for their key is in flight wait
+    for it and share its result instead of running their own. This only
+    coordinates the threads of one process: each gunicorn worker has its own,
+    and it only has something to share under a threaded (gthread) worker.
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn):
+        """Return (result, shared); shared is True when another caller computed it."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                # the leader is stuck; do not queue behind it forever
+                with self._lock:
+                    self.timeouts += 1
+                return fn(), False
+            if call.error is not None:
+                raise call.error
+            with self._lock:
+                self.coalesced += 1
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+            }
+
+
+def request_key():
+    # Everything that can change the response: the path, the query string
+    # with its parameters in a canonical order, the negotiated type, the
+    # conditional headers views may answer themselves, whether the read goes
+    # to the replica, and the table versions seen by @conditional
+    return (
+        request.path,
+        tuple(sorted(request.args.items(multi=True))),
+        request.accept_mimetypes.best,
+        request.headers.get("If-None-Match"),
+        request.headers.get("Range"),
+        bool(g.get("read_replica")),
+        g.get("table_versions"),
+    )
+
+
+def coalesced(flight):
+    """Share one execution of a GET view between identical concurrent requests."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not current_app.config.get("SINGLE_FLIGHT", True):
+                return view(**kwargs)
+
+            own = None
+
+            def compute():
+                nonlocal own
+                own = current_app.make_response(view(**kwargs))
+                # a streamed body can only be sent once, so it is not shared
+                if own.is_streamed:
+                    return None
+                return own.get_data(), own.status_code, list(own.headers.items())
+
+            snapshot, shared = flight.do(request_key(), compute)
+            if not shared:
+                return own
+            if snapshot is None:
+                return view(**kwargs)
+
+            for observer in coalesce_observers:
+                observer(request.endpoint)
+            body, status, headers = snapshot
+            return current_app.response_class(body, status, headers)
+        return wrapper
+    return decorator
@@ -0,0 +1,84 @@
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from models import db
+import metrics
+
+
+def parameter_shape(parameters, executemany=False):
+    # Types only: the values may be passwords or other user data
+    if executemany:
+        rows = list(parameters)
+        return f"{len(rows)} x {parameter_shape(rows[0]) if rows else '()'}"
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def route():
+    if not has_request_context():
+        return "outside a request"
+    return f"{request.method} {request.path} ({request.endpoint})"
+
+
+def setup_sql_inspector(app):
+    """Opt-in with SQL_INSTRUMENTATION=1 (development and staging only).
+
+    Logs every statement slower than SLOW_QUERY_MS and, at the end of a
+    request, every statement issued N_PLUS_ONE_THRESHOLD or more times
+    (the usual shape of an N+1 pattern).
+    """
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    # Timed once, by the metrics listeners, which report every statement here
+    def inspect_statement(statement, parameters, executemany, elapsed):
+        if has_request_context() and "sql_log" in g:
+            g.sql_log.append(statement)
+        if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+            app.logger.warning("slow query (%.1f ms) from %s: %s params=%s", elapsed * 1000,
+                               route(), statement, parameter_shape(parameters, executemany))
+
+    metrics.statement_observers.append(inspect_statement)
+
+    @app.before_request
+    def start_sql_log():
+        g.sql_log = []
+
+    @app.after_request
+    def report_sql_log(response):
+        if "sql_log" not in g:
+            return response
+        for statement, count in Counter(g.sql_log).items():
+            if count >= app.config['N_PLUS_ONE_THRESHOLD']:
+                app.logger.warning("possible N+1 on %s: %d x %s", route(), count, statement)
+        response.headers["X-SQL-Statements"] = str(len(g.sql_log))
+        return response
+
+
+@contextmanager
+def count_queries(app):
+    """Collect every statement run inside the block, e.g. from a test client call."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+
+@contextmanager
+def assert_max_queries(app, limit):
+    with count_queries(app) as statements:
+        yield statements
+    assert len(statements) <= limit, (
+        f"expected at most {limit} statements, got {len(statements)}:\n" + "\n".join(statements))
@@ -15,19 +15,47 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def get_page_args(args, default_limit, max_limit, cursor="after"):
+    """Read the keyset pagination params (?limit=&after=) from a request."""
+    try:
+        limit = int(args.get("limit", default_limit))
+        after = args.get(cursor)
+        after = int(after) if after not in (None, "") else None
+    except ValueError:
+        raise APIException(f"limit and {cursor} must be integers", status_code=400)
+
+    if limit < 1 or limit > max_limit:
+        raise APIException(f"limit must be between 1 and {max_limit}", status_code=400)
+    return limit, after
+
+def get_id_list(args, max_ids):
+    """Read ?ids=1,2,3 from a request, dropping repeats but keeping the order."""
+    raw = args.get("ids")
+    if raw is None:
+        return None
+    try:
+        ids = [int(part) for part in raw.split(",") if part.strip()]
+    except ValueError:
+        raise APIException("ids must be a comma separated list of integers", status_code=400)
+
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > max_ids:
+        raise APIException(f"ids must contain between 1 and {max_ids} ids", status_code=400)
+    return ids
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
-def generate_sitemap(app):
+def generate_sitemap(app, exclude=("/metrics",)):
     links = ['/admin/']
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
         if "GET" in rule.methods and has_no_empty_params(rule):
             url = url_for(rule.endpoint, **(rule.defaults or {}))
-            if "/admin/" not in url:
+            if "/admin/" not in url and url not in exclude:
                 links.append(url)
 
     links_html = "".join(["<li><a href='" + y + "'>" + y + "</a></li>" for y in links])
@@ -0,0 +1,118 @@
+import hashlib
+from functools import wraps
+from flask import Response, g, make_response, request
+from sqlalchemy import event, inspect
+from models import db, TableVersion, User, dialect_insert
+
+
+UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+
+def bump_statements(name, dialect=None):
+    """Statements that increment the named counter, creating it at 1."""
+    if dialect is None:
+        dialect = db.session.get_bind().dialect.name
+    table = TableVersion.__table__
+    if dialect in UPSERT_DIALECTS:
+        stmt = dialect_insert(table, dialect).values(name=name, version=1)
+        return [stmt.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={"version": table.c.version + 1}
+        )]
+    # No ON CONFLICT elsewhere (MySQL, ...): create the row at 0 if it is
+    # missing, then increment it like any other
+    missing = ~db.exists().where(table.c.name == name)
+    return [
+        db.insert(table).from_select(
+            ["name", "version"], db.select(db.literal(name), db.literal(0)).where(missing)),
+        db.update(table).where(table.c.name == name).values(version=table.c.version + 1),
+    ]
+
+
+def bump_versions(*names):
+    """Increment the named counters inside the current transaction.
+
+    Only needed for writes that bypass the ORM (Core INSERT/UPDATE/DELETE):
+    objects going through a flush are counted by bump_flushed_versions.
+    """
+    for name in names:
+        for stmt in bump_statements(name):
+            db.session.execute(stmt)
+
+
+def flushed_changes(session):
+    """Yield (object, whether a user's favorites changed) for each object the
+    flush writes; call from after_flush."""
+    for obj in session.new | session.deleted | session.dirty:
+        if isinstance(obj, TableVersion):
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        favorites = False
+        if isinstance(obj, User):
+            state = inspect(obj)
+            favorites = obj in session.deleted or any(
+                state.attrs[name].history.has_changes()
+                for name in ("favorite_planets", "favorite_people"))
+        yield obj, favorites
+
+
+def flushed_versions(session):
+    names = set()
+    for obj, favorites in flushed_changes(session):
+        names.add(obj.__tablename__)
+        if favorites:
+            names.add(f"favorites:{obj.id}")
+    return sorted(names)
+
+
+@event.listens_for(db.session, "after_flush")
+def bump_flushed_versions(session, flush_context):
+    # Catches every ORM write, Flask-Admin's included, keyed by table name;
+    # after the flush so new rows already have their ids
+    for name in flushed_versions(session):
+        for stmt in bump_statements(name):
+            session.execute(stmt)
+
+
+def versions_statement(names):
+    return (db.select(TableVersion.name, TableVersion.version)
+            .where(TableVersion.name.in_(names)))
+
+
+def etag_for(versions, names, full_path, best_mimetype):
+    # The same counters back several representations of a resource, so the
+    # path, query string and negotiated type are part of the tag as well.
+    parts = [f"{name}={versions.get(name, 0)}" for name in sorted(names)]
+    parts.append(full_path)
+    parts.append(str(best_mimetype))
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def current_etag(names):
+    versions = dict(db.session.execute(versions_statement(names)).all())
+    # lets @coalesced only share bodies built from the same versions
+    g.table_versions = tuple(sorted(versions.items()))
+    return etag_for(versions, names, request.full_path, request.accept_mimetypes.best)
+
+
+def conditional(*names):
+    """Answer If-None-Match with a 304 while none of the counters have moved.
+
+    names may use the view arguments as format fields, e.g. "favorites:{user_id}".
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            tag = current_etag([name.format(**kwargs) for name in names])
+            if request.if_none_match.contains(tag):
+                response = Response(status=304)
+                response.set_etag(tag)
+                return response
+
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                response.set_etag(tag)
+            return response
+        return wrapper
+    return decorator